@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Times the Core operations of GitSwap on a generated repository, and prints the results as JSON.
+
+    python3 -m Benchmarks.GitSwapBenchmark --commits 1000 --overlap 0.3 --output before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from Benchmarks.RepositoryGenerator import RepositoryGenerator
+from Core.CommitWriter import CommitWriter
+from Core.Commutation import ConflictBounds, commutation_cache
+from Core.DiffParser import parse_git_diff
+from Core.GitCommands import Git
+from Core.DiffCache import DiffCache
+from Core.HistoryLoader import HistoryLoader, DIFF_OPTIONS
+from Core.MergeDiff import CommitMerge
+from Core.PatchApplier import HistoryVerifier
+
+
+class Benchmark:
+    """
+    Each operation is run repeat times on the whole history, after a setup which is not timed.
+    """
+
+    def __init__(self, path, repeat):
+        self.path = path
+        self.repeat = repeat
+        self.results = {}
+        self.history = []
+        self.base = None
+
+    def time(self, name, operation, setup=None, items=None):
+        runs = []
+        for _ in range(self.repeat):
+            argument = setup() if setup is not None else None
+            start = time.perf_counter()
+            operation(argument)
+            runs.append(time.perf_counter() - start)
+        self.results[name] = {"min": min(runs), "median": statistics.median(runs), "runs": runs, "items": items}
+        print("{:<16} {:>10.4f} s".format(name, min(runs)), file=sys.stderr)
+
+    def load(self, cache=None):
+        Git.close_session()
+        loader = HistoryLoader(self.path, cache=cache)
+        self.history = list(loader)
+        self.base = loader.root_commit
+        if len(self.history) > 0 and self.history[-1].hash == self.base:
+            self.history.pop()
+        for git_diff in self.history:  # Loading is lazy: include the parsing of the hunks
+            for file_diff in git_diff.file_diffs.values():
+                _ = file_diff.hunks
+
+    def warm_cache(self, directory):
+        # A new cache in a temporary directory: the cache of the repository itself is left alone
+        cache = DiffCache(tempfile.mkdtemp(dir=directory), DIFF_OPTIONS)
+        list(HistoryLoader(self.path, cache=cache))
+        return cache
+
+    def raw_diffs(self):
+        return [(Git.raw_diff(git_diff.hash), git_diff.hash, git_diff.message) for git_diff in self.history]
+
+    @staticmethod
+    def parse(raw_diffs):
+        for raw_diff, git_hash, message in raw_diffs:
+            parse_git_diff(raw_diff, git_hash, message)
+
+    def pairs(self):
+        return [(self.history[i + 1], self.history[i]) for i in range(len(self.history) - 1)]
+
+    @staticmethod
+    def merge(pairs):
+        for left, right in pairs:
+            CommitMerge(left, right)
+
+    def merges(self):
+        return [m for m in (CommitMerge(left, right) for left, right in self.pairs()) if not m.conflicts]
+
+    @staticmethod
+    def swap_and_dump(merges):
+        for merge in merges:
+            merge.swap_all()
+            merge.dump()
+
+    def conflict_bounds(self):
+        commutation_cache.clear()
+        return ConflictBounds(self.history)
+
+    @staticmethod
+    def compute_conflicts(bounds: ConflictBounds):
+        bounds.compute_all()
+
+    def verify(self, _=None):
+        if not HistoryVerifier().verify(self.base, self.history[::-1]):
+            raise RuntimeError("the generated history does not verify")
+
+    def write(self, _=None):
+        # Same content, new commits: HEAD moves, but to the same tree
+        if CommitWriter().write(self.base, self.history[::-1]) is None:
+            raise RuntimeError("the generated history could not be written")
+
+    def run(self):
+        Git.path = self.path
+        commits = len(HistoryLoader(self.path).commits())
+        self.time("load", self.load, items=commits)
+        with tempfile.TemporaryDirectory(prefix="gitswap-cache-") as directory:
+            self.time("load_cached", self.load, lambda: self.warm_cache(directory), items=commits)
+        self.time("parse", self.parse, self.raw_diffs, items=len(self.history))
+        self.time("merge", self.merge, self.pairs, items=len(self.history) - 1)
+        self.time("swap_all_dump", self.swap_and_dump, self.merges, items=len(self.history) - 1)
+        self.time("conflicts", self.compute_conflicts, self.conflict_bounds, items=len(self.history))
+        self.time("verify", self.verify, items=len(self.history))
+        self.time("write", self.write, items=len(self.history))
+        Git.close_session()
+        return self.results
+
+
+def gitswap_commit():
+    out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return out.stdout.decode("utf8").strip() if out.returncode == 0 else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="GitSwapBenchmark", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commits", type=int, default=200, help="length of the history")
+    parser.add_argument("--files", type=int, default=20, help="number of files in the repository")
+    parser.add_argument("--files-per-commit", type=int, default=2, help="files modified by each commit")
+    parser.add_argument("--hunks-per-file", type=int, default=3, help="hunks in each modified file")
+    parser.add_argument("--overlap", type=float, default=0.2,
+                        help="probability for a hunk to modify lines modified by the last commits")
+    parser.add_argument("--file-size", type=int, default=200, help="initial number of lines of the files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each operation")
+    parser.add_argument("--repository", help="where to generate the repository (default: a temporary directory)")
+    parser.add_argument("--output", help="JSON file to write the results to (default: stdout)")
+    arguments = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="gitswap-benchmark-") as directory:
+        path = arguments.repository or os.path.join(directory, "repository")
+        generator = RepositoryGenerator(path, arguments.commits, arguments.files, arguments.files_per_commit,
+                                        arguments.hunks_per_file, arguments.overlap, arguments.file_size,
+                                        arguments.seed)
+        start = time.perf_counter()
+        generator.generate()
+        generation_time = time.perf_counter() - start
+
+        parameters = generator.parameters()
+        parameters.update(seed=arguments.seed, repeat=arguments.repeat)
+        report = {"gitswap_commit": gitswap_commit(), "python": platform.python_version(),
+                  "platform": platform.platform(), "parameters": parameters, "generation": generation_time,
+                  "results": Benchmark(path, arguments.repeat).run()}
+
+    if arguments.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
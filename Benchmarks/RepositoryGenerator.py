@@ -0,0 +1,97 @@
+import os
+import random
+import subprocess
+from typing import Dict, List
+
+
+class RepositoryGenerator:
+    """
+    Generates a linear git history of synthetic text files in a new repository.
+    * commits: length of the history, on top of a root commit adding all the files.
+    * files: number of files, of file_size lines each at first.
+    * files_per_commit: number of files modified by each commit.
+    * hunks_per_file: number of separate places modified in each of these files.
+    * overlap: probability for a hunk to modify the lines modified by one of the last commits, which makes commits
+    conflict when they are swapped.
+
+    The whole history is sent to a single "git fast-import": generating thousands of commits takes seconds.
+    """
+
+    def __init__(self, path, commits=200, files=20, files_per_commit=2, hunks_per_file=3, overlap=0.2,
+                 file_size=200, seed=0):
+        self.path = path
+        self.commits = commits
+        self.files = files
+        self.files_per_commit = min(files_per_commit, files)
+        self.hunks_per_file = hunks_per_file
+        self.overlap = overlap
+        self.file_size = file_size
+        self.random = random.Random(seed)
+        self.contents: Dict[str, List[bytes]] = {}
+        self.recent_lines: List[tuple] = []  # (file, line) modified by the last commits
+        self.line_count = 0
+
+    def parameters(self):
+        return {"commits": self.commits, "files": self.files, "files_per_commit": self.files_per_commit,
+                "hunks_per_file": self.hunks_per_file, "overlap": self.overlap, "file_size": self.file_size}
+
+    def new_line(self):
+        self.line_count += 1
+        return "line {} {}".format(self.line_count, self.random.getrandbits(32)).encode("utf8")
+
+    def modify(self, file_name):
+        lines = self.contents[file_name]
+        recent = [line for f, line in self.recent_lines if f == file_name]
+        for _ in range(self.hunks_per_file):
+            if len(recent) > 0 and self.random.random() < self.overlap:
+                position = self.random.choice(recent)
+            else:
+                position = self.random.randrange(len(lines) + 1)
+            position = min(position, len(lines))
+            operation = self.random.random()
+            if operation < 0.4 and position < len(lines):
+                lines[position] = self.new_line()
+            elif operation < 0.7 or len(lines) < 2:
+                lines[position:position] = [self.new_line() for _ in range(self.random.randint(1, 3))]
+            else:
+                del lines[position:position + self.random.randint(1, 2)]
+            self.recent_lines.append((file_name, position))
+        del self.recent_lines[:-4 * self.hunks_per_file]
+
+    @staticmethod
+    def data(content: bytes):
+        return b"data " + str(len(content)).encode("utf8") + b"\n" + content + b"\n"
+
+    def commit(self, stream, index, message, file_names):
+        stream.write(b"commit refs/heads/master\n")
+        stream.write("committer GitSwap <gitswap@example.com> {} +0000\n".format(1500000000 + index).encode("utf8"))
+        stream.write(self.data(message.encode("utf8")))
+        for file_name in file_names:
+            stream.write("M 100644 inline {}\n".format(file_name).encode("utf8"))
+            stream.write(self.data(b"".join(line + b"\n" for line in self.contents[file_name])))
+        stream.write(b"\n")
+
+    def generate(self):
+        os.makedirs(self.path, exist_ok=True)
+        subprocess.run(["git", "init", "-q", self.path], check=True)
+        subprocess.run(["git", "config", "user.name", "GitSwap"], cwd=self.path, check=True)
+        subprocess.run(["git", "config", "user.email", "gitswap@example.com"], cwd=self.path, check=True)
+        process = subprocess.Popen(["git", "fast-import", "--quiet"], cwd=self.path, stdin=subprocess.PIPE)
+        stream = process.stdin
+
+        names = ["file{}.txt".format(i) for i in range(self.files)]
+        for file_name in names:
+            self.contents[file_name] = [self.new_line() for _ in range(self.file_size)]
+        self.commit(stream, 0, "root", names)
+
+        for index in range(1, self.commits + 1):
+            modified = sorted(self.random.sample(names, self.files_per_commit))
+            for file_name in modified:
+                self.modify(file_name)
+            self.commit(stream, index, "commit {}".format(index), modified)
+
+        stream.close()
+        if process.wait() != 0:
+            raise RuntimeError("git fast-import failed")
+        subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/master"], cwd=self.path, check=True)
+        subprocess.run(["git", "reset", "-q", "--hard"], cwd=self.path, check=True)
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Runs a reorder plan on the history of a repository without the GUI, and prints the result as JSON.
+
+    python3 -m Cli.GitSwapBatch --todo > plan.txt
+    (edit plan.txt)
+    python3 -m Cli.GitSwapBatch plan.txt --write
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+from Core.CommitWriter import CommitWriter
+from Core.Commutation import ConflictBounds
+from Core.Diff import to_string
+from Core.GitCommands import Git
+from Core.DiffCache import DiffCache
+from Core.HistoryLoader import HistoryLoader, DIFF_OPTIONS
+from Core.PatchApplier import HistoryVerifier
+from Core.Plan import Plan, PlanError, PlanConflict, todo
+
+
+def commit_json(git_diff):
+    return {"hash": git_diff.hash, "message": git_diff.message,
+            "files": [to_string(f) for f in git_diff.file_diffs]}
+
+
+def conflicts_json(history):
+    """
+    For each commit (oldest first), the closest newer and older commits it conflicts with.
+    """
+    newest_first = list(reversed(history))
+    bounds = ConflictBounds(newest_first)
+    res = []
+    for row in range(len(newest_first) - 1, -1, -1):
+        top_conflict, bottom_conflict = bounds.get(row)
+        res.append({"hash": newest_first[row].hash,
+                    "newer": None if top_conflict is None else newest_first[top_conflict].hash,
+                    "older": None if bottom_conflict is None else newest_first[bottom_conflict].hash})
+    return res
+
+
+def load(onto, use_cache=True):
+    """
+    Returns the history (newest first) and the commit it is based on. The root commit is never part of the history,
+    since there is nothing to apply it on.
+    """
+    stop_commit = None
+    if onto is not None:
+        stop_commit = Git.commit_object(onto)[0]
+        if stop_commit is None:
+            raise PlanError("unknown commit '{}'".format(onto))
+    cache = DiffCache.for_repository(Git.path, DIFF_OPTIONS) if use_cache else None
+    loader = HistoryLoader(Git.path, stop_commit=stop_commit, cache=cache)
+    history = list(loader)
+    base = loader.root_commit
+    if len(history) > 0 and history[-1].hash == base:
+        history.pop()
+    return history, base
+
+
+def run(arguments, report):
+    timings = report["timings"]
+    start = time.perf_counter()
+    history, base = load(arguments.onto, not arguments.no_cache)
+    timings["load"] = time.perf_counter() - start
+    report["base"] = base
+
+    if arguments.todo:
+        return todo(history)
+
+    original = list(reversed(history))
+    new_history = original
+    if arguments.plan is not None:
+        start = time.perf_counter()
+        if arguments.plan == "-":
+            plan = Plan.parse(sys.stdin, history)
+        else:
+            with open(arguments.plan, encoding="utf8") as plan_file:
+                plan = Plan.parse(plan_file, history)
+        try:
+            new_history = plan.apply(history)
+        finally:
+            timings["plan"] = time.perf_counter() - start
+    report["commits"] = [commit_json(git_diff) for git_diff in new_history]
+
+    if arguments.conflicts:
+        start = time.perf_counter()
+        report["conflicts"] = conflicts_json(new_history)
+        timings["conflicts"] = time.perf_counter() - start
+
+    # Commits which did not change keep their hash: only the ones after the first changed commit are written
+    first_change = 0
+    while first_change < min(len(original), len(new_history)) \
+            and new_history[first_change] is original[first_change]:
+        first_change += 1
+    if first_change == len(new_history) == len(original):
+        report["verified"] = True
+        return None
+    if first_change > 0:
+        base = new_history[first_change - 1].hash
+    git_diffs = new_history[first_change:]
+
+    start = time.perf_counter()
+    verifier = HistoryVerifier()
+    report["verified"] = verifier.verify(base, git_diffs)
+    timings["verify"] = time.perf_counter() - start
+    report["errors"] += verifier.errors
+
+    if arguments.write and report["verified"]:
+        start = time.perf_counter()
+        writer = CommitWriter()
+        hashes = writer.write(base, git_diffs)
+        timings["write"] = time.perf_counter() - start
+        report["errors"] += writer.errors
+        if hashes is not None:
+            report["written"] = hashes
+            for commit, new_hash in zip(report["commits"][first_change:], hashes):
+                commit["new_hash"] = new_hash
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="GitSwapBatch", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("plan", nargs="?", help="plan file (\"-\" for stdin), see --todo")
+    parser.add_argument("-C", dest="path", default=os.getcwd(), help="path of the repository")
+    parser.add_argument("--onto", help="only edit the commits after this one (default: up to the first merge)")
+    parser.add_argument("--todo", action="store_true", help="print a plan keeping the history as it is")
+    parser.add_argument("--conflicts", action="store_true",
+                        help="report, for each commit, the closest commits it conflicts with")
+    parser.add_argument("--write", action="store_true", help="write the new history if it is verified")
+    parser.add_argument("--no-cache", action="store_true", help="run git for every commit instead of reusing the "
+                                                                "diffs cached under the git directory")
+    arguments = parser.parse_args(argv)
+
+    Git.path = os.path.abspath(arguments.path)
+    if not Git.valid_repository():
+        parser.error("{} is not a git repository".format(Git.path))
+
+    report = {"base": None, "commits": [], "conflict": None, "errors": [], "verified": None, "written": None,
+              "timings": {}}
+    # Core modules print their errors: keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            plan_todo = run(arguments, report)
+        except PlanConflict as e:
+            plan_todo = None
+            report["conflict"] = {"commit": e.commit.hash, "message": e.commit.message,
+                                  "other": e.other.hash, "other_message": e.other.message, "files": e.files}
+            report["errors"].append(str(e))
+        except (PlanError, OSError) as e:
+            plan_todo = None
+            report["errors"].append(str(e))
+        finally:
+            Git.close_session()
+
+    if plan_todo is not None:
+        sys.stdout.write(plan_todo)
+        return 0
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0 if report["conflict"] is None and len(report["errors"]) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
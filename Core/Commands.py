@@ -1,15 +1,113 @@
 import os
 import subprocess
+import tempfile
+
+from Core.Tracing import span
 
 PIPE = subprocess.PIPE
 
 
 class Command:
-    def __init__(self, command, work_directory=os.getcwd(), split=True, decodeUtf8=True):
+    def __init__(self, command, work_directory=os.getcwd(), split=True, decodeUtf8=True, input=None, env=None):
         if split:
             command = command.split(" ")
-        process = subprocess.Popen(command, cwd=work_directory, stdout=PIPE, stderr=PIPE)
-        self.stdoutput, self.stderroutput = process.communicate()
+        if env is not None:
+            env = dict(os.environ, **env)
+        with span("git", command=command):
+            process = subprocess.Popen(command, cwd=work_directory, stdin=None if input is None else PIPE,
+                                       stdout=PIPE, stderr=PIPE, env=env)
+            self.stdoutput, self.stderroutput = process.communicate(input)
         if decodeUtf8:
             self.stdoutput, self.stderroutput = self.stdoutput.decode("utf8"), self.stderroutput.decode("utf8")
         self.returncode = process.returncode
+
+
+class InputStreamCommand:
+    """
+    Runs a command whose standard input is written by write_input(stdin) a chunk at a time, instead of being passed as
+    one bytes object. Its outputs go to temporary files, so that it never blocks on a full pipe while its input is
+    still being written.
+    """
+
+    def __init__(self, command, write_input, work_directory=os.getcwd(), split=True, decodeUtf8=True, env=None):
+        if split:
+            command = command.split(" ")
+        if env is not None:
+            env = dict(os.environ, **env)
+        with span("git (input stream)", command=command), tempfile.TemporaryFile() as stdout, \
+                tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, cwd=work_directory, stdin=PIPE, stdout=stdout, stderr=stderr, env=env)
+            try:
+                write_input(process.stdin)
+            except BrokenPipeError:  # The command exited early: its error is in stderr
+                pass
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.returncode = process.wait()
+            stdout.seek(0)
+            stderr.seek(0)
+            self.stdoutput, self.stderroutput = stdout.read(), stderr.read()
+        if decodeUtf8:
+            self.stdoutput, self.stderroutput = self.stdoutput.decode("utf8"), self.stderroutput.decode("utf8")
+
+
+class StreamCommand:
+    """
+    Runs a command whose output is consumed line by line while it is produced, instead of being buffered by
+    communicate(). Lines are yielded as raw bytes, including their trailing b"\\n".
+    """
+
+    def __init__(self, command, work_directory=os.getcwd(), split=True, stdin=None):
+        if split:
+            command = command.split(" ")
+        self.span = span("git (stream)", command=command).begin()
+        self.process = subprocess.Popen(command, cwd=work_directory, stdin=stdin, stdout=PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.returncode = None
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.returncode = self.process.wait()
+        self.span.end()
+        return self.returncode
+
+
+class BatchCommand:
+    """
+    Keeps a command running in the background, so that requests can be written to its standard input and their
+    answers read from its standard output without paying for a process startup each time.
+    """
+
+    def __init__(self, command, work_directory=os.getcwd(), split=True):
+        if split:
+            command = command.split(" ")
+        self.process = subprocess.Popen(command, cwd=work_directory, stdin=PIPE, stdout=PIPE,
+                                        stderr=subprocess.DEVNULL)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def write(self, request: bytes):
+        self.process.stdin.write(request)
+        self.process.stdin.flush()
+
+    def readline(self) -> bytes:
+        return self.process.stdout.readline()
+
+    def read(self, size) -> bytes:
+        return self.process.stdout.read(size)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from typing import List, Optional
+
+from Core.Diff import GitDiff
+from Core.GitCommands import Git
+from Core.Tracing import span, traced
+
+
+class CommitWriter:
+    """
+    Writes a list of GitDiffs (oldest first) as new commits on top of a base commit, then moves HEAD to the last one.
+
+    Patches are applied with "git apply --cached" to a temporary index (GIT_INDEX_FILE), and commits are created with
+    write-tree and commit-tree: the worktree, the index, the stash and untracked files are never touched.
+    Since the rewritten history must end on the tree of HEAD, HEAD is only moved if it does, in a single update-ref.
+    """
+
+    def __init__(self):
+        self.errors: List[str] = []
+
+    def error(self, message):
+        self.errors.append(message)
+        print(message)
+
+    @staticmethod
+    def message(git_diff: GitDiff):
+        """
+        Returns the message bytes and their encoding (None for UTF-8). The whole message of the original commit is
+        kept as is, unless its subject was edited.
+        """
+        if git_diff.hash is not None and Git.message(git_diff.hash) == git_diff.message:
+            _, headers, message = Git.commit_object(git_diff.hash)
+            return message, Git.encoding(headers)
+        return git_diff.message.encode("utf8"), None
+
+    @traced("CommitWriter.write")
+    def write(self, base, git_diffs: List[GitDiff]) -> Optional[List[str]]:
+        """
+        Returns the hashes of the new commits, or None (with the reasons in self.errors) if nothing was changed.
+        """
+        self.errors = []
+        head = Git.current_hash()
+        head_tree = Git.tree(head)
+
+        handle, index_file = tempfile.mkstemp(prefix="gitswap-index-", dir=Git.git_dir())
+        os.close(handle)
+        try:
+            if not Git.read_tree(index_file, base):
+                self.error("Error while reading the tree of {}".format(base))
+                return None
+
+            hashes = []
+            parent = base
+            tree = Git.tree(base)
+            for git_diff in git_diffs:
+                with span("write commit", commit=git_diff.hash, files=len(git_diff.file_diffs)):
+                    if len(git_diff.file_diffs) > 0:
+                        out = Git.apply_cached(index_file, git_diff)
+                        if not out.returncode == 0:
+                            self.error("Error while applying '{}': {}".format(git_diff.message, out.stderroutput))
+                            return None
+
+                    tree = Git.write_tree(index_file)
+                    env = Git.author(git_diff.hash) if git_diff.hash is not None else None
+                    message, encoding = self.message(git_diff)
+                    parent = Git.commit_tree(tree, parent, message, env, encoding)
+                    if tree is None or parent is None:
+                        self.error("Error while committing '{}'".format(git_diff.message))
+                        return None
+                    hashes.append(parent)
+        finally:
+            os.remove(index_file)
+
+        if tree != head_tree:
+            self.error("The new history does not lead to the content of HEAD: it was not written")
+            return None
+
+        if not Git.update_head(parent, head):
+            self.error("Error while moving HEAD to the new history")
+            return None
+        return hashes
@@ -0,0 +1,306 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Callable
+
+from Core.Diff import GitDiff, FileDiff, Hunk, Stats
+from Core.FileIndex import FileIndex
+from Core.MergeDiff import MergeFileDiff, merged_metadata
+from Core.Tracing import span
+
+# Estimated memory held by a cached Commutation, in bytes (measured with tracemalloc on synthetic histories): the
+# FileDiffs of the files modified by both commits are new objects, the other ones are shared with the history
+ENTRY_WEIGHT = 300  # Commutation, key and lists
+FILE_WEIGHT = 300  # FileDiff and Metadata
+HUNK_WEIGHT = 100  # Hunk, Stats and list of lines
+SHARED_LINE_WEIGHT = 8  # Swapped hunks reference the Lines of the original ones
+MERGED_LINE_WEIGHT = 100  # Merged hunks have Lines of their own
+
+
+class Commutation:
+    """
+    Result of swapping two consecutive commits, the left one being applied first.
+    If there is no conflict, left_file_diffs hold the changes of the right commit moved before the left one, and
+    right_file_diffs the changes of the left commit applied after them.
+    """
+    __slots__ = ("conflicts", "left_file_diffs", "right_file_diffs", "weight")
+
+    def __init__(self, conflicts, left_file_diffs: Optional[List[FileDiff]],
+                 right_file_diffs: Optional[List[FileDiff]], weight=ENTRY_WEIGHT):
+        self.conflicts = conflicts
+        self.left_file_diffs = left_file_diffs
+        self.right_file_diffs = right_file_diffs
+        self.weight = weight  # Estimated memory held by the new FileDiffs, see ENTRY_WEIGHT
+
+
+def share_files(left: GitDiff, right: GitDiff):
+    return not left.file_diffs.keys().isdisjoint(right.file_diffs.keys())
+
+
+def hunk_range(start, size):
+    """
+    Lines covered by a side of a hunk, as an inclusive range. Empty sides (size 0) are counted as covering their start
+    line, so that insertions next to another hunk still go through the full merge.
+    """
+    return start, start + max(size, 1) - 1
+
+
+def hunks_overlap(left: FileDiff, right: FileDiff):
+    """
+    Whether the lines produced by the left hunks and the lines modified by the right hunks intersect in the file
+    between the two commits. Both lists of hunks are sorted, so a single sweep is enough.
+    """
+    left_ranges = [hunk_range(h.stats.addition_start_line, h.stats.additionSize) for h in left.hunks]
+    right_ranges = [hunk_range(h.stats.deletion_start_line, h.stats.deletionSize) for h in right.hunks]
+    i = 0
+    j = 0
+    while i < len(left_ranges) and j < len(right_ranges):
+        left_start, left_end = left_ranges[i]
+        right_start, right_end = right_ranges[j]
+        if left_end < right_start:
+            i += 1
+        elif right_end < left_start:
+            j += 1
+        else:
+            return True
+    return False
+
+
+def size_delta(stats: Stats):
+    return (1 if stats.additionSize == -1 else stats.additionSize) - (
+        1 if stats.deletionSize == -1 else stats.deletionSize)
+
+
+def swap_hunks(file_name: bytes, left: FileDiff, right: FileDiff):
+    """
+    Swaps the hunks of a file modified by two commits when they do not overlap: only their line numbers change, by the
+    number of lines added or removed by the hunks of the other commit located before them.
+    """
+    new_left = []
+    offset = 0
+    i = 0
+    for hunk in right.hunks:
+        stats = hunk.stats
+        while i < len(left.hunks) and \
+                hunk_range(left.hunks[i].stats.addition_start_line, left.hunks[i].stats.additionSize)[1] \
+                < stats.deletion_start_line:
+            offset += size_delta(left.hunks[i].stats)
+            i += 1
+        new_left.append(Hunk(hunk.lines, Stats(stats.deletion_start_line - offset, stats.deletionSize,
+                                               stats.addition_start_line - offset, stats.additionSize)))
+
+    new_right = []
+    offset = 0
+    j = 0
+    for hunk in left.hunks:
+        stats = hunk.stats
+        while j < len(right.hunks) and \
+                hunk_range(right.hunks[j].stats.deletion_start_line, right.hunks[j].stats.deletionSize)[1] \
+                < stats.addition_start_line:
+            offset += size_delta(right.hunks[j].stats)
+            j += 1
+        new_right.append(Hunk(hunk.lines, Stats(stats.deletion_start_line + offset, stats.deletionSize,
+                                                stats.addition_start_line + offset, stats.additionSize)))
+
+    missing_between = left.deletes_file()
+    return FileDiff(new_left, merged_metadata(file_name, left.creates_file(), missing_between)), \
+           FileDiff(new_right, merged_metadata(file_name, missing_between, right.deletes_file()))
+
+
+def compute_commutation(left: GitDiff, right: GitDiff) -> Commutation:
+    """
+    Same result as swapping all the lines of a CommitMerge of both commits, except that files modified by a single
+    commit are kept as they are, and that only files whose hunks overlap go through the line by line merge.
+    """
+    files = sorted(set(left.file_diffs).union(right.file_diffs))
+    new_left = []
+    new_right = []
+    weight = ENTRY_WEIGHT
+    for file_name in files:
+        left_file_diff = left.file_diffs.get(file_name)
+        right_file_diff = right.file_diffs.get(file_name)
+        if left_file_diff is None:
+            new_left.append(right_file_diff)
+            continue
+        if right_file_diff is None:
+            new_right.append(left_file_diff)
+            continue
+
+        if hunks_overlap(left_file_diff, right_file_diff):
+            merge = MergeFileDiff(left_file_diff, right_file_diff)
+            if merge.conflicts:
+                return Commutation(True, None, None)
+            merge.swap_all()
+            new_left_file_diff, new_right_file_diff = merge.file_diffs(file_name)
+            line_weight = MERGED_LINE_WEIGHT
+        else:
+            new_left_file_diff, new_right_file_diff = swap_hunks(file_name, left_file_diff, right_file_diff)
+            line_weight = SHARED_LINE_WEIGHT
+
+        for new_file_diff, new_file_diffs in ((new_left_file_diff, new_left), (new_right_file_diff, new_right)):
+            if new_file_diff is not None:
+                new_file_diffs.append(new_file_diff)
+                weight += FILE_WEIGHT + sum(HUNK_WEIGHT + line_weight * len(hunk.lines)
+                                            for hunk in new_file_diff.hunks)
+
+    return Commutation(False, new_left, new_right, weight)
+
+
+class CommutationCache:
+    """
+    LRU cache of the commutations of pairs of commits, keyed by the patch ids of both commits: reordering unrelated
+    commits, or commits getting new hashes, does not invalidate it.
+    Entries are weighted by an estimate of the memory they hold (see ENTRY_WEIGHT), and evicted once max_size is
+    exceeded.
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def commute(self, left: GitDiff, right: GitDiff) -> Commutation:
+        if not share_files(left, right):  # Cheaper than hashing the patches
+            return compute_commutation(left, right)
+
+        key = left.patch_id(), right.patch_id()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        with span("compute_commutation", left=left.hash, right=right.hash):
+            res = compute_commutation(left, right)
+        weight = res.weight
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = res, weight
+                self.size += weight
+            while self.size > self.max_size and len(self.entries) > 1:
+                _, (_, evicted_weight) = self.entries.popitem(last=False)
+                self.size -= evicted_weight
+        return res
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def statistics(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "size": self.size}
+
+
+commutation_cache = CommutationCache()
+
+
+def commute(left: GitDiff, right: GitDiff) -> Commutation:
+    return commutation_cache.commute(left, right)
+
+
+class ConflictBounds:
+    """
+    For each commit of a history (newest first, as in Main.history), the rows of the closest commits above (top) and
+    below (bottom) it conflicts with when moved towards them, None meaning it can be moved to the end of the history.
+    Bounds are computed once, then only the ones which may have changed are recomputed after an edit (see replace).
+    """
+
+    def __init__(self, history: List[GitDiff], file_index: FileIndex = None):
+        self.history = history
+        self.bounds: List[Optional[Tuple[Optional[int], Optional[int]]]] = [None] * len(history)
+        self.file_index = FileIndex(history) if file_index is None else file_index
+
+    def snapshot(self) -> "ConflictBounds":
+        """
+        Returns a copy of the bounds and of the history, which the edits of the history do not change: it can be
+        computed in another thread while the history is edited.
+        """
+        history = tuple(self.history)
+        res = ConflictBounds(history, self.file_index.copy(history))
+        res.bounds = list(self.bounds)
+        return res
+
+    def compute(self, row, cancelled: Callable[[], bool] = None):
+        """
+        Returns None if cancelled() became True before the end of the computation.
+        """
+        top_conflict = None
+        bottom_conflict = None
+
+        current_diff = self.history[row]
+        i = self.file_index.next_row(row, current_diff.file_diffs, -1)
+        while i is not None:
+            next_diff = self.history[i]
+            if cancelled is not None and cancelled():
+                return None
+            commutation = commute(current_diff, next_diff)
+            if commutation.conflicts:
+                top_conflict = i
+                break
+            current_diff = GitDiff(commutation.right_file_diffs, current_diff.hash, current_diff.message)
+            i = self.file_index.next_row(i, current_diff.file_diffs, -1)
+
+        current_diff = self.history[row]
+        i = self.file_index.next_row(row, current_diff.file_diffs, 1)
+        while i is not None:
+            previous_diff = self.history[i]
+            if cancelled is not None and cancelled():
+                return None
+            commutation = commute(previous_diff, current_diff)
+            if commutation.conflicts:
+                bottom_conflict = i
+                break
+            current_diff = GitDiff(commutation.left_file_diffs, current_diff.hash, current_diff.message)
+            i = self.file_index.next_row(i, current_diff.file_diffs, 1)
+
+        return top_conflict, bottom_conflict
+
+    def known(self, row):
+        return self.bounds[row] is not None
+
+    def get(self, row, cancelled: Callable[[], bool] = None):
+        bounds = self.bounds[row]
+        if bounds is None:
+            with span("ConflictBounds.compute", row=row, commit=self.history[row].hash):
+                bounds = self.compute(row, cancelled)
+            self.bounds[row] = bounds
+        return bounds
+
+    def set(self, row, bounds: Tuple[Optional[int], Optional[int]]):
+        self.bounds[row] = bounds
+
+    def compute_all(self):
+        for row in range(0, len(self.history)):
+            self.get(row)
+
+    def replace(self, start, stop, count):
+        """
+        To be called once the rows start .. stop - 1 of the history have been replaced by count rows.
+        Only the bounds of the commits whose scan went through these rows are forgotten, the others are shifted.
+        """
+        self.file_index.replace(start, stop, count)
+        delta = count - (stop - start)
+        bounds = []
+        for row_bounds in self.bounds[:start]:
+            if row_bounds is not None and (row_bounds[1] is None or row_bounds[1] >= start):
+                row_bounds = None
+            bounds.append(row_bounds)
+        bounds += [None] * count
+        for row_bounds in self.bounds[stop:]:
+            if row_bounds is not None:
+                top_conflict, bottom_conflict = row_bounds
+                if top_conflict is None or top_conflict < stop:
+                    row_bounds = None
+                else:
+                    row_bounds = top_conflict + delta, None if bottom_conflict is None else bottom_conflict + delta
+            bounds.append(row_bounds)
+        self.bounds = bounds
+
+    def invalidate(self):
+        self.bounds = [None] * len(self.history)
+        self.file_index = FileIndex(self.history)
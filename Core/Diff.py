@@ -1,6 +1,8 @@
+import hashlib
 from collections import OrderedDict
 from enum import Enum
-from typing import List, Iterator, Generator
+from io import BytesIO
+from typing import List, Iterator, Generator, Optional, Callable, Dict
 
 
 class Source(Enum):
@@ -17,10 +19,25 @@ class LineType(Enum):
 
 
 def join(enumerable):
-    res = b""
+    sink = BytesIO()
     for e in enumerable:
-        res += e.to_bytes()
-    return res
+        e.write(sink)
+    return sink.getvalue()
+
+
+class HashSink:
+    """
+    Binary sink computing the SHA-1 and the size of the data written to it, without keeping the data.
+    """
+    __slots__ = ("hash", "size")
+
+    def __init__(self):
+        self.hash = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.hash.update(data)
+        self.size += len(data)
 
 
 def nformat(elt):
@@ -34,10 +51,27 @@ def to_string(bytes_array):
     return bytes_array.decode("utf8", "replace")
 
 
+def strip_prefix(line: bytes, prefix: bytes):
+    return line[len(prefix):] if line.startswith(prefix) else line
+
+
+INTERN_MAX_LENGTH = 16
+
+
+def intern_content(content: bytes, interned: Optional[Dict[bytes, bytes]]):
+    # Short lines (blank lines, braces, "else:", ...) are repeated all over diffs: share a single bytes object per
+    # table. A table belongs to one load of a history (see HistoryLoader), and is freed with it
+    if interned is None or len(content) > INTERN_MAX_LENGTH:
+        return content
+    return interned.setdefault(content, content)
+
+
 class Line:
-    def __init__(self, line_type: LineType, content: bytes, no_new_line):
+    __slots__ = ("type", "content", "no_new_line")
+
+    def __init__(self, line_type: LineType, content: bytes, no_new_line, interned: Dict[bytes, bytes] = None):
         self.type = line_type
-        self.content = content.rstrip(b"\n").rstrip(b"\r")
+        self.content = intern_content(content.rstrip(b"\n").rstrip(b"\r"), interned)
         self.no_new_line = no_new_line
 
     def to_bytes(self):
@@ -60,6 +94,8 @@ class Line:
 
 
 class Stats:
+    __slots__ = ("deletion_start_line", "deletionSize", "addition_start_line", "additionSize")
+
     def __init__(self, deletion_start_line: int, deletion_size: int, addition_start_line: int, addition_size: int):
         self.deletion_start_line = deletion_start_line
         self.deletionSize = deletion_size
@@ -80,18 +116,27 @@ class Stats:
 
 
 class Hunk:
+    __slots__ = ("lines", "stats")
+
     def __init__(self, lines: List[Line], stats: Stats):
         self.lines = lines
         self.stats = stats
 
+    def write(self, sink):
+        # One chunk per hunk
+        sink.write(b"".join((self.stats.to_bytes(), b"\n".join(l.to_bytes() for l in self.lines), b"\n")))
+
     def to_bytes(self):
-        return self.stats.to_bytes() + b"\n".join(l.to_bytes() for l in self.lines) + b"\n"
+        return join((self,))
 
     def __str__(self):
         return to_string(self.to_bytes())
 
 
 class Metadata:
+    __slots__ = ("diff", "deleted_file", "new_file", "index", "similarity", "minus", "plus", "rename_from",
+                 "rename_to")
+
     def __init__(self, diff, deleted_file, new_file, index, similarity, minus, plus, rename_from, rename_to):
         self.diff = diff
         self.deleted_file = deleted_file
@@ -112,34 +157,109 @@ class Metadata:
                and self.rename_to is None
 
     def to_bytes(self):
-        ret = self.diff + b"\n"
-        ret += nformat(self.deleted_file)
-        ret += nformat(self.new_file)
-        ret += nformat(self.index)
-        ret += nformat(self.similarity)
-        ret += nformat(self.minus)
-        ret += nformat(self.plus)
-        ret += nformat(self.rename_from)
-        ret += nformat(self.rename_to)
-
-        return ret
+        return b"".join((self.diff + b"\n", nformat(self.deleted_file), nformat(self.new_file), nformat(self.index),
+                         nformat(self.similarity), nformat(self.minus), nformat(self.plus),
+                         nformat(self.rename_from), nformat(self.rename_to)))
+
+    def write(self, sink):
+        sink.write(self.to_bytes())
 
     def __str__(self):
         return to_string(self.to_bytes())
 
 
+class RawHunks:
+    """
+    Hunks of a FileDiff which are not parsed yet: buffer[start:end], parsed by parse(buffer, start, end, interned)
+    when called (see intern_content).
+    """
+    __slots__ = ("buffer", "start", "end", "parse", "interned")
+
+    def __init__(self, buffer: bytes, start, end, parse: Callable[..., List[Hunk]],
+                 interned: Dict[bytes, bytes] = None):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.parse = parse
+        self.interned = interned
+
+    def __call__(self) -> List[Hunk]:
+        return self.parse(self.buffer, self.start, self.end, self.interned)
+
+    def view(self) -> memoryview:
+        return memoryview(self.buffer)[self.start:self.end]
+
+
 class FileDiff:
-    def __init__(self, hunks: List[Hunk], metadata: Metadata):
-        self.hunks = hunks
+    __slots__ = ("_hunks", "load_hunks", "metadata", "_patch_id")
+
+    def __init__(self, hunks: Optional[List[Hunk]], metadata: Metadata,
+                 load_hunks: Optional[Callable[[], List[Hunk]]] = None):
+        """
+        hunks may be None if load_hunks is given: they are then only parsed the first time they are accessed.
+        """
+        self._hunks = hunks
+        self.load_hunks = load_hunks
         self.metadata = metadata
+        self._patch_id = None
+
+    @property
+    def hunks(self) -> List[Hunk]:
+        # Read from the GUI thread and from the conflict worker at the same time: load_hunks is read once, and only
+        # cleared after _hunks is set, so a concurrent first read parses the hunks twice at worst
+        hunks = self._hunks
+        if hunks is None:
+            load_hunks = self.load_hunks
+            if load_hunks is None:  # Loaded by another thread since _hunks was read
+                return self._hunks
+            hunks = load_hunks()
+            self._hunks = hunks
+            self.load_hunks = None
+        return hunks
+
+    @hunks.setter
+    def hunks(self, hunks: List[Hunk]):
+        self._hunks = hunks
+        self.load_hunks = None
+        self._patch_id = None
+
+    def patch_id(self):
+        """
+        Hash of the patch of the file (see GitDiff.patch_id). Hunks which are not parsed yet are hashed from the bytes
+        they will be parsed from, so that hashing does not parse them.
+        """
+        if self._patch_id is None:
+            sink = HashSink()
+            load_hunks = self.load_hunks
+            if self._hunks is None and isinstance(load_hunks, RawHunks):
+                self.metadata.write(sink)
+                sink.write(load_hunks.view())
+            else:
+                self.write(sink)
+            self._patch_id = sink.hash.digest()
+        return self._patch_id
+
+    def hunks_loaded(self):
+        return self._hunks is not None
+
+    def creates_file(self):
+        return self.metadata.minus == b"--- /dev/null"
+
+    def deletes_file(self):
+        return self.metadata.plus == b"+++ /dev/null"
+
+    def path(self) -> bytes:
+        if self.metadata.plus is not None and self.metadata.plus != b"+++ /dev/null":
+            return strip_prefix(self.metadata.plus, b"+++ b/")
+        return strip_prefix(self.metadata.minus, b"--- a/")
+
+    def write(self, sink):
+        self.metadata.write(sink)
+        for hunk in self.hunks:
+            hunk.write(sink)
 
     def to_bytes(self):
-        if len(self.hunks) == 1:
-            if self.hunks[0].stats.addition_start_line == 0 and self.hunks[0].stats.additionSize == 0:
-                self.metadata.plus = b"+++ /dev/null"
-            if self.hunks[0].stats.deletion_start_line == 0 and self.hunks[0].stats.deletionSize == 0:
-                self.metadata.minus = b"--- /dev/null"
-        return self.metadata.to_bytes() + join(self.hunks)
+        return join((self,))
 
     def __str__(self):
         return to_string(self.to_bytes())
@@ -151,13 +271,32 @@ class GitDiff:
         self.message = message
         self.file_diffs: OrderedDict[str, FileDiff] = OrderedDict()
         for file_diff in file_diffs:
-            if file_diff.metadata.plus != b"+++ /dev/null":
-                self.file_diffs[file_diff.metadata.plus.lstrip(b"+++ b/")] = file_diff
-            else:
-                self.file_diffs[file_diff.metadata.minus.lstrip(b"--- a/")] = file_diff
+            self.file_diffs[file_diff.path()] = file_diff
+        self._patch_id = None
+
+    def patch_id(self):
+        """
+        Hash of the patch itself, independent from the commit hash and message. Unlike "git patch-id", line numbers
+        are part of it, since the result of swapping two commits depends on them.
+        It is built from the patch ids of the files, so that files whose hunks are not parsed yet stay unparsed.
+        """
+        if self._patch_id is None:
+            sink = HashSink()
+            for file_diff in self.file_diffs.values():
+                sink.write(file_diff.patch_id())
+            self._patch_id = sink.hash.digest()
+        return self._patch_id
+
+    def write(self, sink):
+        """
+        Writes the patch to a binary sink (anything with a write(bytes) method: BytesIO, file, pipe, HashSink), a hunk
+        at a time: it never exists as a whole in memory.
+        """
+        for file_diff in self.file_diffs.values():
+            file_diff.write(sink)
 
     def to_bytes(self):
-        return join(self.file_diffs.values())
+        return join((self,))
 
     def __str__(self):
         return to_string(self.to_bytes())
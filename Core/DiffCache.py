@@ -0,0 +1,126 @@
+import hashlib
+import os
+import struct
+import tempfile
+import time
+import zlib
+from typing import Optional
+
+from Core.Commands import Command
+
+CACHE_DIRECTORY = "gitswap-cache"
+MAX_SIZE = 128 * 1024 * 1024
+TEMPORARY_PREFIX = ".tmp-"
+TEMPORARY_MAX_AGE = 3600  # Seconds after which an entry still being written was left by a process which died
+
+# Magic, format version, size of the diff and CRC32 of the diff, followed by the compressed diff
+HEADER = struct.Struct("<4sBII")
+MAGIC = b"GSDC"
+VERSION = 1
+
+
+class DiffCache:
+    """
+    Raw diffs of commits, as printed by "git diff-tree <options>", stored in <git dir>/gitswap-cache so that reloading
+    a history does not run git again for the commits already seen. A commit never changes: an entry is valid forever
+    for a given commit hash and diff options, which select the sub-directory of the cache.
+
+    Entries are zlib compressed, one file per commit. A damaged entry (wrong magic, version, size or CRC) is a miss.
+    Once the cache grows beyond max_size, the least recently used entries are removed (see prune).
+    """
+
+    def __init__(self, directory, options, max_size=MAX_SIZE):
+        self.root = directory
+        self.directory = os.path.join(directory, hashlib.sha1(options.encode("utf8")).hexdigest()[:12])
+        self.max_size = max_size
+        self.writes = 0
+        self.read = []  # Entries read since the last touch
+
+    @classmethod
+    def for_repository(cls, path, options, max_size=MAX_SIZE) -> Optional["DiffCache"]:
+        out = Command("git rev-parse --absolute-git-dir", path)
+        if out.returncode != 0:
+            return None
+        return cls(os.path.join(out.stdoutput.strip(), CACHE_DIRECTORY), options, max_size)
+
+    def entry(self, commit):
+        return os.path.join(self.directory, commit[:2], commit[2:])
+
+    def get(self, commit) -> Optional[bytes]:
+        path = self.entry(commit)
+        try:
+            with open(path, "rb") as entry:
+                data = entry.read()
+        except OSError:
+            return None
+        self.read.append(path)
+        if len(data) < HEADER.size:
+            return None
+        magic, version, size, crc = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            return None
+        try:
+            raw_diff = zlib.decompress(data[HEADER.size:])
+        except zlib.error:
+            return None
+        if len(raw_diff) != size or zlib.crc32(raw_diff) != crc:
+            return None
+        return raw_diff
+
+    def put(self, commit, raw_diff: bytes):
+        data = HEADER.pack(MAGIC, VERSION, len(raw_diff), zlib.crc32(raw_diff)) + zlib.compress(raw_diff, 1)
+        directory = os.path.dirname(self.entry(commit))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Written aside then renamed: readers never see a partial entry
+            descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX)
+            with os.fdopen(descriptor, "wb") as entry:
+                entry.write(data)
+            os.replace(temporary, self.entry(commit))
+            self.writes += 1
+        except OSError as e:
+            print("Diff cache: cannot write {}: {}".format(commit, e))
+
+    def touch(self):
+        """
+        Marks the entries read since the last call as recently used, in one batch once per load: get() does not touch
+        them, so that a hit only reads the disk.
+        """
+        for path in self.read:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        self.read = []
+
+    def prune(self):
+        """
+        Removes the least recently used entries, whatever their diff options, until the cache fits in max_size.
+        The files left by an interrupted put() are removed once stale.
+        """
+        self.touch()
+        now = time.time()
+        entries = []
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                    if file_name.startswith(TEMPORARY_PREFIX):
+                        if now - stat.st_mtime > TEMPORARY_MAX_AGE:
+                            os.remove(path)
+                        continue  # Otherwise still being written by another process
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
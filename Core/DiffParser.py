@@ -1,22 +1,74 @@
+from typing import Iterable, Iterator
+
 from Core.Diff import *
 from Core.MergeDiff import MergeFileDiff
+from Core.Tracing import span
+
 
+class LineReader:
+    """
+    Reads lines one at a time from a list, an iterator or a binary file-like object (such as a pipe), keeping only
+    the last line read in memory so that it can be put back once with back().
+    Trailing b"\\n" are removed, so that both pipes and b"...".split(b"\\n") can be read.
+    """
 
-class MyList(List):
-    def __init__(self, **kwargs):
-        super().__init__(kwargs)
-        self.idx = 0
+    def __init__(self, lines: Iterable[bytes]):
+        self.lines = iter(lines)
+        self.last = None
+        self.pushed_back = False
 
     def next(self):
-        try:
-            ret = self[self.idx]
-            self.idx += 1
-            return ret
-        except IndexError:
-            return None
+        if self.pushed_back:
+            self.pushed_back = False
+            return self.last
+        line = next(self.lines, None)
+        if line is not None and line.endswith(b"\n"):
+            line = line[:-1]
+        self.last = line
+        return line
 
     def back(self):
-        self.idx -= 1
+        self.pushed_back = True
+
+
+class BufferReader(LineReader):
+    """
+    LineReader over a bytes buffer, which keeps track of the offsets of the lines so that whole files can be skipped
+    without being split into lines.
+    """
+
+    def __init__(self, buffer: bytes, start=0, end=None):
+        super().__init__(())
+        self.buffer = buffer
+        self.position = start
+        self.end = len(buffer) if end is None else end
+        self.last_start = start
+
+    def next(self):
+        if self.pushed_back:
+            self.pushed_back = False
+            return self.last
+        if self.position >= self.end:
+            self.last = None
+            return None
+        self.last_start = self.position
+        line_end = self.buffer.find(b"\n", self.position, self.end)
+        if line_end == -1:
+            line_end = self.end
+        self.last = self.buffer[self.position:line_end]
+        self.position = line_end + 1
+        return self.last
+
+    def skip_file(self):
+        """
+        Skips the hunks of the current file, starting with the last line read, and returns their (start, end) offsets.
+        """
+        start = self.last_start if self.pushed_back else self.position
+        end = self.buffer.find(b"\ndiff --git", start, self.end)
+        end = self.end if end == -1 else end + 1
+        self.position = end
+        self.pushed_back = False
+        return start, end
 
 
 def check(line, code, throws=True):
@@ -55,7 +107,7 @@ def parse_line_type(string):
     raise Exception("Unknown LineType")
 
 
-def parse_file_diff(lines: MyList):
+def parse_file_diff(lines: LineReader, interned: Dict[bytes, bytes] = None):
     hunks = []
     line = lines.next()
     while line is not None:
@@ -67,7 +119,7 @@ def parse_file_diff(lines: MyList):
             if line.startswith(b"@@") or line.startswith(b"diff --git"):
                 lines.back()
                 break
-            last_added_line = Line(parse_line_type(chr(line[0]).encode("utf8")), line[1:], False)
+            last_added_line = Line(parse_line_type(chr(line[0]).encode("utf8")), line[1:], False, interned)
             difflines.append(last_added_line)
             line = lines.next()
             if line is not None:
@@ -83,9 +135,48 @@ def parse_file_diff(lines: MyList):
     return hunks
 
 
-def _parse_git_diff(lines: MyList, git_hash, message):
-    file_diffs = []
+LINE_TYPES = {ord(line_type.value): line_type for line_type in
+              (LineType.CONTEXT, LineType.NO_ENDLINE_CONTEXT, LineType.ADDITION, LineType.DELETION)}
+HUNK_START = ord("@")
+NO_NEW_LINE = ord("\\")
+
+
+def parse_hunks(buffer: bytes, start, end, interned: Dict[bytes, bytes] = None):
+    """
+    Same as parse_file_diff(BufferReader(buffer, start, end)), working on offsets: the content of each Line is the
+    only copy of its bytes, sliced once from buffer, instead of a copy of the whole line sliced again without its type.
+    """
+    with span("parse hunks", size=end - start):
+        hunks = []
+        lines = None
+        last_added_line = None
+        position = start
+        while position < end:
+            line_end = buffer.find(b"\n", position, end)
+            if line_end == -1:
+                line_end = end
+            first = buffer[position]
+            if first == HUNK_START and buffer.startswith(b"@@", position) or lines is None:
+                if buffer.startswith(b"diff --git", position):
+                    break
+                lines = []
+                last_added_line = None
+                hunks.append(Hunk(lines, parse_stats(buffer[position:line_end])))
+            elif first == NO_NEW_LINE and last_added_line is not None:
+                last_added_line.no_new_line = True
+                last_added_line = None
+            elif buffer.startswith(b"diff --git", position):
+                break
+            else:
+                if first not in LINE_TYPES:
+                    raise Exception("Unknown LineType")
+                last_added_line = Line(LINE_TYPES[first], buffer[position + 1:line_end], False, interned)
+                lines.append(last_added_line)
+            position = line_end + 1
+        return hunks
+
 
+def _iter_file_diffs(lines: LineReader, lazy, interned: Dict[bytes, bytes] = None):
     line = lines.next()
     while line is not None:
         diff = None
@@ -136,17 +227,35 @@ def _parse_git_diff(lines: MyList, git_hash, message):
             rename_to = line
             line = lines.next()
 
-        if not line.startswith(b"diff --git"):
+        if line is not None and not line.startswith(b"diff --git"):
             lines.back()
-            file_diffs.append(FileDiff(parse_file_diff(lines),
-                                       Metadata(diff, deleted_file, new_file, index, similarity,
-                                                minus, plus, rename_from, rename_to)))
+            metadata = Metadata(diff, deleted_file, new_file, index, similarity,
+                                minus, plus, rename_from, rename_to)
+            if lazy:
+                start, end = lines.skip_file()
+                yield FileDiff(None, metadata, RawHunks(lines.buffer, start, end, parse_hunks, interned))
+            else:
+                yield FileDiff(parse_file_diff(lines, interned), metadata)
             line = lines.next()
 
-    return GitDiff(file_diffs, git_hash, message)
+
+def iter_file_diffs(raw_diff: Iterable[bytes]) -> Iterator[FileDiff]:
+    """
+    Yields the FileDiffs of a git diff one at a time, while reading it: only the lines of the current file are kept
+    in memory.
+    """
+    return _iter_file_diffs(LineReader(raw_diff), lazy=False)
+
+
+def parse_git_diff(diff: Iterable[bytes], git_hash, message):
+    with span("parse_git_diff", commit=git_hash):
+        return GitDiff(iter_file_diffs(diff), git_hash, message)
 
 
-def parse_git_diff(diff: List[bytes], git_hash, message):
-    mydiff = MyList()
-    mydiff.extend(diff)
-    return _parse_git_diff(mydiff, git_hash, message)
+def parse_raw_git_diff(raw_diff: bytes, git_hash, message, interned: Dict[bytes, bytes] = None):
+    """
+    Only parses the file headers of the diff: the hunks of each file are parsed from raw_diff the first time they are
+    accessed. Their short lines are then shared through interned (see intern_content).
+    """
+    with span("parse_raw_git_diff", commit=git_hash, size=len(raw_diff)):
+        return GitDiff(_iter_file_diffs(BufferReader(raw_diff), lazy=True, interned=interned), git_hash, message)
@@ -0,0 +1,58 @@
+from typing import List
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over the positions 0 .. size - 1: adding to a position and summing a prefix both cost
+    O(log size).
+    """
+    __slots__ = ("size", "tree")
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    @classmethod
+    def from_values(cls, values: List[int]):
+        """
+        Builds the tree in O(size).
+        """
+        res = cls(len(values))
+        tree = res.tree
+        for i, value in enumerate(values, 1):
+            tree[i] += value
+            parent = i + (i & -i)
+            if parent <= res.size:
+                tree[parent] += tree[i]
+        return res
+
+    def add(self, position, delta):
+        i = position + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, position):
+        """
+        Sum of the values of positions 0 .. position (included).
+        """
+        res = 0
+        i = min(position + 1, self.size)
+        while i > 0:
+            res += self.tree[i]
+            i -= i & -i
+        return res
+
+    def find(self, total):
+        """
+        Smallest position whose prefix sum is at least total, assuming all values are non-negative.
+        Returns size if there is none.
+        """
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step > 0:
+            if position + step <= self.size and self.tree[position + step] < total:
+                position += step
+                total -= self.tree[position]
+            step >>= 1
+        return position
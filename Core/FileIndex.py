@@ -0,0 +1,61 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Iterable, Optional
+
+from Core.Diff import GitDiff
+
+
+class FileIndex:
+    """
+    For each file, the sorted rows of the commits of a history (as in Main.history) which touch it: the next commit
+    sharing a file with a given one is found without visiting the commits in between.
+    """
+
+    def __init__(self, history: List[GitDiff]):
+        self.history = history
+        self.rows: Dict[bytes, List[int]] = {}
+        for row, git_diff in enumerate(history):
+            for file_name in git_diff.file_diffs:
+                self.rows.setdefault(file_name, []).append(row)
+
+    def copy(self, history: List[GitDiff]) -> "FileIndex":
+        """
+        Returns an index of history, a copy of this one, built without walking the commits again.
+        """
+        res = FileIndex([])
+        res.history = history
+        res.rows = {file_name: list(rows) for file_name, rows in self.rows.items()}
+        return res
+
+    def next_row(self, row, files: Iterable[bytes], step) -> Optional[int]:
+        """
+        Returns the closest row after row (step = 1) or before it (step = -1) of a commit touching one of files.
+        """
+        res = None
+        for file_name in files:
+            rows = self.rows.get(file_name)
+            if rows is None:
+                continue
+            if step > 0:
+                i = bisect_right(rows, row)
+                if i < len(rows) and (res is None or rows[i] < res):
+                    res = rows[i]
+            else:
+                i = bisect_left(rows, row) - 1
+                if i >= 0 and (res is None or rows[i] > res):
+                    res = rows[i]
+        return res
+
+    def replace(self, start, stop, count):
+        """
+        To be called once the rows start .. stop - 1 of the history have been replaced by count rows.
+        """
+        delta = count - (stop - start)
+        for file_name in list(self.rows):
+            rows = self.rows[file_name]
+            first = bisect_left(rows, start)
+            rows[first:] = [row + delta for row in rows[bisect_left(rows, stop):]]
+            if len(rows) == 0:
+                del self.rows[file_name]
+        for row in range(start, start + count):
+            for file_name in self.history[row].file_diffs:
+                insort(self.rows.setdefault(file_name, []), row)
@@ -1,10 +1,19 @@
 import os
+import re
 
-from Core.Commands import Command
+from Core.Commands import Command, BatchCommand, InputStreamCommand
+from Core.Tracing import span
+
+END_OF_COMMIT = b"GitSwap: end of commit\n"
+HASH = re.compile(r"^[0-9a-f]{40}$")
+GIT_SPACES = b" \t\n\r"  # isspace() of git
 
 
 class Git:
     path = os.getcwd()
+    session_path = None
+    cat_file_session = None
+    diff_tree_session = None
 
     @classmethod
     def valid_repository(cls):
@@ -18,69 +27,185 @@ class Git:
     def current_hash(cls):
         return Command("git rev-parse HEAD", cls.path).stdoutput.strip()
 
+    @classmethod
+    def session(cls):
+        """
+        Returns the long-lived "git cat-file --batch" and "git diff-tree --stdin -p" processes of the repository,
+        (re)starting them if Git.path changed or if they died.
+        """
+        if cls.session_path != cls.path or not cls.cat_file_session.alive() or not cls.diff_tree_session.alive():
+            cls.close_session()
+            cls.cat_file_session = BatchCommand("git cat-file --batch", cls.path)
+            cls.diff_tree_session = BatchCommand("git diff-tree --stdin -p", cls.path)
+            cls.session_path = cls.path
+        return cls.cat_file_session, cls.diff_tree_session
+
+    @classmethod
+    def close_session(cls):
+        for session in (cls.cat_file_session, cls.diff_tree_session):
+            if session is not None:
+                session.close()
+        cls.cat_file_session = None
+        cls.diff_tree_session = None
+        cls.session_path = None
+
+    @classmethod
+    def cat_file(cls, revision):
+        """
+        Returns (hash, type, content) of any object git can name, or None if it does not exist.
+        """
+        cat_file, _ = cls.session()
+        with span("cat-file", revision=revision):
+            cat_file.write(revision.encode("utf8") + b"\n")
+            header = cat_file.readline().rstrip(b"\n").split(b" ")
+            if len(header) != 3:  # "<revision> missing" or "<revision> ambiguous"
+                return None
+            content = cat_file.read(int(header[2]))
+            cat_file.read(1)  # Trailing newline
+        return header[0].decode("utf8"), header[1].decode("utf8"), content
+
+    @classmethod
+    def commit_object(cls, commit):
+        """
+        Returns the hash, headers (as a list of (key, value)) and raw message of a commit.
+        """
+        res = cls.cat_file(commit)
+        if res is None or res[1] != "commit":
+            return None, [], b""
+        git_hash, _, content = res
+        headers, _, message = content.partition(b"\n\n")
+        headers = [tuple(line.split(b" ", 1)) for line in headers.split(b"\n") if not line.startswith(b" ")]
+        return git_hash, headers, message
+
     @classmethod
     def parents(cls, commit):
-        res = Command("git rev-list --parents -n 1 {}".format(commit), cls.path)
-        return res.stdoutput.strip().split(" ")[1:]
+        _, headers, _ = cls.commit_object(commit)
+        return [value.decode("utf8") for key, value in headers if key == b"parent"]
+
+    @staticmethod
+    def encoding(headers):
+        """
+        Returns the encoding of the message of a commit, from its headers (None for UTF-8).
+        """
+        for key, value in headers:
+            if key == b"encoding":
+                return value.decode("ascii", "replace")
+        return None
+
+    @staticmethod
+    def decode(message: bytes, encoding=None):
+        try:
+            return message.decode(encoding or "utf8")
+        except (LookupError, UnicodeDecodeError):
+            return message.decode("utf8", "replace")
 
     @classmethod
     def message(cls, commit):
-        res = Command("git log -n 1 --pretty=format:%s {}".format(commit), cls.path)
-        return res.stdoutput
+        """
+        Same as "--format=%s": the lines of the first paragraph of the message, without their trailing whitespace,
+        joined with spaces, and decoded with the encoding of the commit.
+        """
+        _, headers, message = cls.commit_object(commit)
+        lines = []
+        for line in message.split(b"\n"):
+            line = line.rstrip(GIT_SPACES)
+            if line == b"":
+                if len(lines) > 0:  # Leading blank lines are skipped, the next ones end the subject
+                    break
+                continue
+            lines.append(line)
+        return cls.decode(b" ".join(lines), cls.encoding(headers))
 
     @classmethod
     def raw_diff(cls, commit):
-        res = Command("git diff-tree -p {}".format(commit), cls.path, decodeUtf8=False)
-        return res.stdoutput.split(b'\n')[1:-1]
+        if not HASH.match(commit):  # diff-tree --stdin only understands full hashes
+            commit = cls.commit_object(commit)[0]
+            if commit is None:
+                return []
+        _, diff_tree = cls.session()
+        header = commit.encode("utf8") + b"\n"
+        with span("diff-tree", commit=commit):
+            diff_tree.write(header + END_OF_COMMIT)
+            res = []
+            line = diff_tree.readline()
+            if line == header:  # Nothing is printed for root commits
+                line = diff_tree.readline()
+            while line != END_OF_COMMIT and line != b"":
+                res.append(line.rstrip(b"\n"))
+                line = diff_tree.readline()
+        return res
 
     @classmethod
-    def tag(cls, tag):
-        res = Command("git tag {}".format(tag), cls.path)
-        return res.stderroutput == ""
+    def git_dir(cls):
+        return Command("git rev-parse --absolute-git-dir", cls.path).stdoutput.strip()
 
     @classmethod
-    def stash(cls):
-        res = Command("git stash -u", cls.path)
-        return res.stderroutput == ""
+    def tree(cls, commit):
+        res = Command("git rev-parse --verify -q {}^{{tree}}".format(commit), cls.path)
+        return res.stdoutput.strip() if res.returncode == 0 else None
 
     @classmethod
-    def stash_pop(cls):
-        res = Command("git stash pop", cls.path)
-        return res.stderroutput == ""
+    def author(cls, commit):
+        """
+        Returns the GIT_AUTHOR_* environment variables reproducing the author of commit.
+        """
+        _, headers, _ = cls.commit_object(commit)
+        for key, value in headers:
+            if key == b"author":
+                name, _, rest = value.decode("utf8", "surrogateescape").partition(" <")  # Bytes kept as they are
+                email, _, date = rest.partition("> ")
+                return {"GIT_AUTHOR_NAME": name, "GIT_AUTHOR_EMAIL": email, "GIT_AUTHOR_DATE": date}
+        return {}
 
     @classmethod
-    def reset_to(cls, commit):
-        res = Command("git reset --hard {}".format(commit), cls.path)
-        return res.stderroutput == ""
+    def changed_files(cls, old_commit, new_commit):
+        out = Command("git diff-tree -r -z --name-only {} {}".format(old_commit, new_commit), cls.path,
+                      decodeUtf8=False)
+        return [path for path in out.stdoutput.split(b"\x00") if path != b""]
 
     @classmethod
-    def clean_patch(cls):
-        os.remove(cls.path + "/commit")
+    def read_tree(cls, index_file, commit):
+        out = Command("git read-tree {}".format(commit), cls.path, env={"GIT_INDEX_FILE": index_file})
+        if not out.returncode == 0:
+            print("git read-tree: {}".format(out.stderroutput))
+        return out.returncode == 0
 
     @classmethod
-    def apply_and_stage(cls, patch):
-        with open(cls.path + "/commit", 'wb') as file:
-            file.write(patch)
-        out = Command("git apply commit", cls.path)
-        res = out.returncode == 0
-        if not out.returncode == 0:
-            print("git apply: {}".format(out.stderroutput))
+    def apply_cached(cls, index_file, git_diff):
+        # The patch is streamed to "git apply" instead of being built in memory first
+        out = InputStreamCommand("git apply --cached -", git_diff.write, cls.path, env={"GIT_INDEX_FILE": index_file})
+        return out
 
-        out = Command("git add .", cls.path)
-        res = res and out.returncode == 0
-        if not out.returncode == 0:
-            print("git add: {}".format(out.stderroutput))
-        out = Command("git reset -- commit", cls.path)
-        res = res and out.returncode == 0
+    @classmethod
+    def write_tree(cls, index_file):
+        out = Command("git write-tree", cls.path, env={"GIT_INDEX_FILE": index_file})
+        return out.stdoutput.strip() if out.returncode == 0 else None
+
+    @classmethod
+    def commit_tree(cls, tree, parent, message: bytes, env=None, encoding=None):
+        """
+        message is written as is: encoding (None for UTF-8) is recorded in the "encoding" header of the commit.
+        """
+        command = ["git", "commit-tree", tree, "-F", "-"]
+        if parent is not None:
+            command += ["-p", parent]
+        if encoding is not None:
+            command[1:1] = ["-c", "i18n.commitEncoding=" + encoding]
+        out = Command(command, cls.path, split=False, input=message, env=env)
         if not out.returncode == 0:
-            print("git reset: {}".format(out.stderroutput))
-        return res
+            print("git commit-tree: {}".format(out.stderroutput))
+            return None
+        return out.stdoutput.strip()
 
     @classmethod
-    def commit(cls, message):
-        command = ["git", "commit", "-m", "{}".format(message)]
+    def update_head(cls, new_commit, old_commit):
+        command = ["git", "update-ref", "-m", "GitSwap", "HEAD", new_commit, old_commit]
         out = Command(command, cls.path, split=False)
         if not out.returncode == 0:
-            print("git commit: {}".format(out.stderroutput))
+            print("git update-ref: {}".format(out.stderroutput))
+        return out.returncode == 0
 
-        return out
+    @classmethod
+    def tag(cls, tag):
+        res = Command("git tag {}".format(tag), cls.path)
+        return res.stderroutput == ""
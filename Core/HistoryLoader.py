@@ -0,0 +1,128 @@
+import threading
+from typing import List, Tuple, Iterator, Optional
+
+from Core.Commands import StreamCommand, PIPE
+from Core.Diff import GitDiff
+from Core.DiffCache import DiffCache
+from Core.DiffParser import parse_raw_git_diff
+from Core.GitCommands import END_OF_COMMIT, Git
+from Core.Tracing import span
+
+DIFF_OPTIONS = "-p"  # Options of diff-tree, part of the key of the cached diffs
+
+
+class HistoryLoader:
+    """
+    Loads the first-parent history of HEAD, newest commit first, stopping before the first merge commit (or
+    stop_commit). Only two git processes are spawned whatever the length of the history:
+    * "git log" lists the hashes, parents and subjects of the commits.
+    * "git diff-tree --stdin -p" streams the diffs of all these commits. Only their file headers are parsed as they
+    arrive, hunks are parsed when they are first needed (see parse_raw_git_diff).
+
+    diff-tree echoes the lines of its input which are not commit ids: END_OF_COMMIT is sent after each hash to
+    delimit the records, since diff-tree prints nothing at all for a root commit.
+
+    The short lines of the diffs of a load share one intern table (see intern_content), freed with the history.
+
+    With a cache (see DiffCache.for_repository), only the commits missing from it are sent to diff-tree, and their
+    diffs are added to it.
+    """
+
+    def __init__(self, path, stop_commit=None, cache: Optional[DiffCache] = None):
+        self.path = path
+        self.stop_commit = stop_commit
+        self.root_commit = None
+        self.cache = cache
+
+    def commits(self) -> List[Tuple[str, str]]:
+        """
+        Returns the (hash, subject) of the commits to load, and sets root_commit to the commit on top of which they
+        were made (or to the root commit itself if the whole history is loaded).
+        """
+        commits = []
+        log = StreamCommand(["git", "log", "--first-parent", "--format=%H %P%x00%s"], self.path, split=False)
+        try:
+            for line in log:
+                hashes, subject = line.rstrip(b"\n").split(b"\x00", 1)
+                hashes = Git.decode(hashes).split(" ")
+                commit, parents = hashes[0], [p for p in hashes[1:] if p != ""]
+                self.root_commit = commit
+                if len(parents) > 1 or commit == self.stop_commit:
+                    break
+                # Re-encoded to UTF-8 by git when the commit has an encoding header, raw bytes otherwise
+                commits.append((commit, Git.decode(subject)))
+        finally:
+            log.close()
+        return commits
+
+    @staticmethod
+    def record(lines: Iterator[bytes], commit):
+        """
+        Yields the diff lines of one commit from the diff-tree output, and consumes its END_OF_COMMIT.
+        """
+        header = commit.encode("utf8") + b"\n"
+        line = next(lines, END_OF_COMMIT)
+        if line == header:
+            line = next(lines, END_OF_COMMIT)
+        while line != END_OF_COMMIT:
+            yield line
+            line = next(lines, END_OF_COMMIT)
+
+    def cached_diffs(self, commits):
+        cached = {}
+        if self.cache is not None:
+            with span("read cache", commits=len(commits)) as cache_span:
+                for commit, _ in commits:
+                    raw_diff = self.cache.get(commit)
+                    if raw_diff is not None:
+                        cached[commit] = raw_diff
+                cache_span.set(hits=len(cached))
+        return cached
+
+    def __iter__(self) -> Iterator[GitDiff]:
+        commits = self.commits()
+        if len(commits) == 0:
+            return
+
+        interned = {}
+        cached = self.cached_diffs(commits)
+        missing = [commit for commit, _ in commits if commit not in cached]
+        if len(missing) == 0:
+            self.cache.touch()
+            for commit, message in commits:
+                yield parse_raw_git_diff(cached[commit], commit, message, interned)
+            return
+
+        diff_tree = StreamCommand("git diff-tree --stdin " + DIFF_OPTIONS, self.path, stdin=PIPE)
+
+        def feed():
+            try:
+                for commit in missing:
+                    diff_tree.process.stdin.write(commit.encode("utf8") + b"\n" + END_OF_COMMIT)
+                diff_tree.process.stdin.close()
+            except (BrokenPipeError, ValueError):  # The reader stopped early
+                pass
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+
+        try:
+            lines = iter(diff_tree)
+            for commit, message in commits:
+                if commit in cached:
+                    yield parse_raw_git_diff(cached.pop(commit), commit, message, interned)
+                    continue
+                with span("read commit", commit=commit):
+                    raw_diff = b"".join(self.record(lines, commit))
+                    if self.cache is not None:
+                        self.cache.put(commit, raw_diff)
+                    git_diff = parse_raw_git_diff(raw_diff, commit, message, interned)
+                yield git_diff
+        finally:
+            diff_tree.close()
+            writer.join()
+            if self.cache is not None:
+                if self.cache.writes > 0:
+                    self.cache.prune()
+                else:
+                    self.cache.touch()
@@ -1,18 +1,130 @@
+from io import BytesIO
 from typing import Optional, List, Dict
 
-from Core.Diff import Line, FileDiff, LineType, Source, GitDiff
+from Core.Diff import Line, FileDiff, LineType, Source, GitDiff, Hunk, Stats, Metadata, join
+from Core.FenwickTree import FenwickTree
+from Core.Tracing import span, traced
+
+
+class MiddleIndexes:
+    """
+    Stores the middle_index of the lines of a MergeFileDiff, so that adding or removing a line from the middle file
+    (which shifts the middle_index of all the following lines) costs O(log n) instead of O(n).
+
+    The middle_index of the line at a given position is its base plus the sum of the shifts recorded at or before
+    this position: inserting or removing a line records a +1 or -1 shift right after it.
+    """
+    __slots__ = ("bases", "deltas", "shifts", "present")
+
+    def __init__(self, middle_indexes: List[Optional[int]]):
+        self.bases = list(middle_indexes)
+        self.deltas = [0] * len(middle_indexes)  # Plain copy of the values of the shifts tree
+        self.shifts = FenwickTree(len(middle_indexes))
+        self.present = FenwickTree.from_values([0 if idx is None else 1 for idx in middle_indexes])
+
+    def values(self) -> List[Optional[int]]:
+        res = []
+        shift = 0
+        for base, delta in zip(self.bases, self.deltas):
+            shift += delta
+            res.append(None if base is None else base + shift)
+        return res
+
+    def get(self, position):
+        base = self.bases[position]
+        if base is None:
+            return None
+        return base + self.shifts.prefix_sum(position)
+
+    def previous(self, position):
+        """
+        Returns the middle_index of the closest line at or before position which is in the middle file.
+        """
+        count = self.present.prefix_sum(position)
+        if count == 0:
+            return None
+        return self.get(self.present.find(count))
+
+    def insert(self, position):
+        previous = self.previous(position)
+        middle_index = 1 if previous is None else previous + 1
+        self.bases[position] = middle_index - self.shifts.prefix_sum(position)
+        self.present.add(position, 1)
+        self.add_shift(position + 1, 1)
+
+    def remove(self, position):
+        self.bases[position] = None
+        self.present.add(position, -1)
+        self.add_shift(position + 1, -1)
+
+    def add_shift(self, position, delta):
+        if position < len(self.deltas):
+            self.deltas[position] += delta
+            self.shifts.add(position, delta)
+
+    def toggle(self, positions: List[int]):
+        """
+        Inserts or removes all the given positions at once, with the same result as calling insert() or remove() on
+        each of them in increasing order: the new indexes are computed in a single pass keeping a running sum of the
+        shifts, then the trees are rebuilt in O(n).
+        """
+        toggled = [False] * len(self.bases)
+        for position in positions:
+            toggled[position] = True
+
+        res = []
+        shift = 0
+        previous = None
+        for middle_index, toggle in zip(self.values(), toggled):
+            if toggle:
+                if middle_index is None:
+                    middle_index = 1 if previous is None else previous + 1
+                    shift += 1
+                else:
+                    middle_index = None
+                    shift -= 1
+            elif middle_index is not None:
+                middle_index += shift
+            if middle_index is not None:
+                previous = middle_index
+            res.append(middle_index)
+
+        MiddleIndexes.__init__(self, res)
+
+
+# Default of the middle_index arguments of MergeLine: read it from the MiddleIndexes, in O(log n). Callers walking
+# all the lines pass the ones of MiddleIndexes.values() instead
+CURRENT_MIDDLE_INDEX = object()
 
 
 class MergeLine:
+    __slots__ = ("conflicts", "line", "source", "left_index", "_middle_index", "right_index", "move",
+                 "middle_indexes", "position")
+
     def __init__(self, line: Line, source: Source, left_index: Optional[int], middle_index: Optional[int],
                  right_index: Optional[int]):
         self.conflicts = False
-        self.line = Line(line.type, line.content, line.no_new_line)
+        self.line = line  # Shared with the FileDiff: replaced, never modified
         self.source = source
         self.left_index = left_index
-        self.middle_index = middle_index
+        self._middle_index = middle_index
         self.right_index = right_index
         self.move = False
+        # Once the MergeFileDiff is loaded, middle_index is stored there
+        self.middle_indexes: Optional[MiddleIndexes] = None
+        self.position = None
+
+    @property
+    def middle_index(self):
+        if self.middle_indexes is None:
+            return self._middle_index
+        return self.middle_indexes.get(self.position)
+
+    @middle_index.setter
+    def middle_index(self, middle_index):
+        if self.middle_indexes is not None:
+            raise AttributeError("middle_index is managed by MergeFileDiff.move once loaded")
+        self._middle_index = middle_index
 
     def to_bytes(self):
         left = "_" if self.left_index is None else self.left_index
@@ -45,40 +157,48 @@ class MergeLine:
     def is_context(self):
         return self.line.type == LineType.CONTEXT or self.line.type == LineType.NO_ENDLINE_CONTEXT
 
-    def present_on_left(self):
-        return (self.left_index is not None) or (self.middle_index is not None)
+    def present_on_left(self, middle_index=CURRENT_MIDDLE_INDEX):
+        if middle_index is CURRENT_MIDDLE_INDEX:
+            middle_index = self.middle_index
+        return (self.left_index is not None) or (middle_index is not None)
 
-    def present_on_right(self):
-        return (self.middle_index is not None) or (self.right_index is not None)
+    def present_on_right(self, middle_index=CURRENT_MIDDLE_INDEX):
+        if middle_index is CURRENT_MIDDLE_INDEX:
+            middle_index = self.middle_index
+        return (middle_index is not None) or (self.right_index is not None)
 
-    def dump_as_left(self):
+    def dump_as_left(self, middle_index=CURRENT_MIDDLE_INDEX):
+        if middle_index is CURRENT_MIDDLE_INDEX:
+            middle_index = self.middle_index
 
-        if self.left_index is None and self.middle_index is not None:
+        if self.left_index is None and middle_index is not None:
             type = LineType.ADDITION
-        elif self.left_index is not None and self.middle_index is None:
+        elif self.left_index is not None and middle_index is None:
             type = LineType.DELETION
         elif self.line.type == LineType.NO_ENDLINE_CONTEXT:
             type = LineType.NO_ENDLINE_CONTEXT
         else:
             type = LineType.CONTEXT
 
-        if self.present_on_left():
-            return self.left_index, self.middle_index, Line(type, self.line.content, self.line.no_new_line)
+        if self.present_on_left(middle_index):
+            return self.left_index, middle_index, Line(type, self.line.content, self.line.no_new_line)
         else:
             return None, None, ""
 
-    def dump_as_right(self):
+    def dump_as_right(self, middle_index=CURRENT_MIDDLE_INDEX):
+        if middle_index is CURRENT_MIDDLE_INDEX:
+            middle_index = self.middle_index
 
-        if self.middle_index is None and self.right_index is not None:
+        if middle_index is None and self.right_index is not None:
             type = LineType.ADDITION
-        elif self.middle_index is not None and self.right_index is None:
+        elif middle_index is not None and self.right_index is None:
             type = LineType.DELETION
         elif self.line.type == LineType.NO_ENDLINE_CONTEXT:
             type = LineType.NO_ENDLINE_CONTEXT
         else:
             type = LineType.CONTEXT
-        if self.present_on_right():
-            return self.middle_index, self.right_index, Line(type, self.line.content, self.line.no_new_line)
+        if self.present_on_right(middle_index):
+            return middle_index, self.right_index, Line(type, self.line.content, self.line.no_new_line)
         else:
             return None, None, ""
 
@@ -141,16 +261,35 @@ def compute_stats(array, stat_index, source):
     return "@@ -{},{} +{},{} @@\n".format(left_start, left_size, right_start, right_size)
 
 
+def merged_metadata(file_name: bytes, created=False, deleted=False):
+    # The same headers as the ones written by CommitMerge.dump, unless the file does not exist before or after the diff
+    minus = b"--- /dev/null" if created else b"--- a/" + file_name
+    plus = b"+++ /dev/null" if deleted else b"+++ b/" + file_name
+    return Metadata(b"diff --git", None, None, None, None, minus, plus, None, None)
+
+
 class MergeFileDiff:
     def __init__(self, left_file_diff: FileDiff, right_file_diff: FileDiff):
         self.conflicts = False
+        # Whether the file is missing before, between and after the two commits
+        first_file_diff = right_file_diff if left_file_diff is None else left_file_diff
+        last_file_diff = left_file_diff if right_file_diff is None else right_file_diff
+        self.missing = (first_file_diff.creates_file(),
+                        right_file_diff.creates_file() if left_file_diff is None else left_file_diff.deletes_file(),
+                        last_file_diff.deletes_file())
         if left_file_diff is None:
             left_file_diff = FileDiff([], right_file_diff.metadata)
         if right_file_diff is None:
             right_file_diff = FileDiff([], left_file_diff.metadata)
 
         self.merge_lines: List[MergeLine] = []
-        self.load(left_file_diff, right_file_diff)
+        with span("MergeFileDiff.load", file=first_file_diff.path()) as load_span:
+            self.load(left_file_diff, right_file_diff)
+            load_span.set(lines=len(self.merge_lines))
+        self.middle_indexes = MiddleIndexes([line.middle_index for line in self.merge_lines])
+        for position, line in enumerate(self.merge_lines):
+            line.middle_indexes = self.middle_indexes
+            line.position = position
 
     def load(self, left_file_diff: FileDiff, right_file_diff: FileDiff):
         """
@@ -213,7 +352,7 @@ class MergeFileDiff:
                         if not right.is_context():
                             # If both left and right are significant, we have a left addition and a right deletion
                             right_offset += right.offset()
-                            left.line.type = LineType.ADD_DEL
+                            left.line = Line(LineType.ADD_DEL, left.line.content, left.line.no_new_line)
                         else:
                             left.right_index = left.middle_index + right_offset
                         self.merge_lines.append(left)
@@ -243,58 +382,64 @@ class MergeFileDiff:
                     left_idx += 1
                 break
 
+    # The move operations return the rows of the lines which were moved, in increasing order: the middle_index of
+    # all the lines after the first one may have changed as well
+
     def reset(self):
-        for i in range(0, len(self.merge_lines)):
-            if self.merge_lines[i].move:
-                self.move(i)
+        return self.move_lines([i for i, line in enumerate(self.merge_lines) if line.move])
 
     def swap_all(self):
-        for i in range(0, len(self.merge_lines)):
-            self.move(i)
+        return self.move_lines(range(0, len(self.merge_lines)))
 
     def move_left(self):
-        for i in range(0, len(self.merge_lines)):
-            line = self.merge_lines[i]
+        lines = []
+        for i, line in enumerate(self.merge_lines):
             if line.is_add_del():
                 if not line.move:
-                    self.move(i)
+                    lines.append(i)
             elif line.source == Source.LEFT and line.move or line.source == Source.RIGHT and not line.move:
-                self.move(i)
+                lines.append(i)
+        return self.move_lines(lines)
 
     def move_right(self):
-        for i in range(0, len(self.merge_lines)):
-            line = self.merge_lines[i]
+        lines = []
+        for i, line in enumerate(self.merge_lines):
             if line.is_add_del():
                 if not line.move:
-                    self.move(i)
+                    lines.append(i)
             elif line.source == Source.LEFT and not line.move or line.source == Source.RIGHT and line.move:
-                self.move(i)
+                lines.append(i)
+        return self.move_lines(lines)
 
     def move(self, line_index):
         line: MergeLine = self.merge_lines[line_index]
         if line.is_context():
-            return
+            return []
         line.move = not line.move
 
         if line.middle_index is None:
-            offset = 1
-            for i in range(line_index, -1, -1):
-                idx = self.merge_lines[i].middle_index
-                if idx is not None:
-                    line.middle_index = idx + 1
-                    break
-            else:
-                line.middle_index = 1
+            self.middle_indexes.insert(line_index)
         else:
-            line.middle_index = None
-            offset = -1
+            self.middle_indexes.remove(line_index)
+        return [line_index]
 
-        for i in range(line_index + 1, len(self.merge_lines)):
-            line = self.merge_lines[i]
-            if line.middle_index is not None:
-                line.middle_index += offset
-
-    def make_stats(self, buffers):
+    def move_lines(self, line_indexes):
+        """
+        Same as calling move() on each line in increasing order. A few lines (such as a selection of the merge window)
+        are moved one at a time in O(log n) each, larger batches in a single O(n) pass (see MiddleIndexes.toggle).
+        """
+        moved = [i for i in line_indexes if not self.merge_lines[i].is_context()]
+        if len(moved) * len(self.merge_lines).bit_length() < len(self.merge_lines):
+            for i in moved:
+                self.move(i)
+        elif len(moved) > 0:
+            for i in moved:
+                line = self.merge_lines[i]
+                line.move = not line.move
+            self.middle_indexes.toggle(moved)
+        return moved
+
+    def make_hunks(self, buffers) -> List[Hunk]:
         res = []
         for buffer in buffers:
             left_start = buffer[0][0]
@@ -326,10 +471,7 @@ class MergeFileDiff:
                     right_end = right_start
                 right_size = right_end - right_start + 1
 
-            res.append("@@ -{},{} +{},{} @@".format(left_start, left_size, right_start, right_size).encode("utf8"))
-            for elt in buffer:
-                _, _, line = elt
-                res.append(line.to_bytes())
+            res.append(Hunk([line for _, _, line in buffer], Stats(left_start, left_size, right_start, right_size)))
         return res
 
     def process(self, buffer):
@@ -388,30 +530,52 @@ class MergeFileDiff:
             last_idx = left, right
         buffers += self.process(buffer)
 
-        return self.make_stats(buffers)
+        return self.make_hunks(buffers)
 
-    def dump(self):
+    def hunks(self, middle_indexes: List[Optional[int]]):
+        """
+        Returns the hunks of the left and right commits, as currently split by the moves. middle_indexes are the
+        current ones of all the lines (see MiddleIndexes.values).
+        """
         left_res = []
         right_res = []
-        for merge_line in self.merge_lines:
+        for merge_line, middle_index in zip(self.merge_lines, middle_indexes):
             merge_line: MergeLine = merge_line
-            if merge_line.present_on_left():
-                left_res.append(merge_line.dump_as_left())
-            if merge_line.present_on_right():
-                right_res.append(merge_line.dump_as_right())
+            if merge_line.present_on_left(middle_index):
+                left_res.append(merge_line.dump_as_left(middle_index))
+            if merge_line.present_on_right(middle_index):
+                right_res.append(merge_line.dump_as_right(middle_index))
 
-        left_res = self.clean_raw_res(left_res)
-        right_res = self.clean_raw_res(right_res)
+        return self.clean_raw_res(left_res), self.clean_raw_res(right_res)
 
-        return b"\n".join(left_res), b"\n".join(right_res)
-        # left = self.dump_left(left_res)
-        # right = self.dump_right(left_res)
+    @traced("MergeFileDiff.file_diffs")
+    def file_diffs(self, file_name: bytes):
+        """
+        Returns the left and right FileDiffs of file_name (None if a side has no hunk left), without going through
+        their patch bytes.
+        """
+        left_hunks, right_hunks = self.hunks(self.middle_indexes.values())
+        missing_before, missing_between, missing_after = self.missing
+        if len(left_hunks) == 0:
+            missing_between = missing_before
+        elif len(right_hunks) == 0:
+            missing_between = missing_after
+
+        left = None
+        right = None
+        if len(left_hunks) > 0:
+            left = FileDiff(left_hunks, merged_metadata(file_name, missing_before, missing_between))
+        if len(right_hunks) > 0:
+            right = FileDiff(right_hunks, merged_metadata(file_name, missing_between, missing_after))
+        return left, right
+
+    @traced("MergeFileDiff.dump")
+    def dump(self):
+        left_hunks, right_hunks = self.hunks(self.middle_indexes.values())
+        return join(left_hunks)[:-1], join(right_hunks)[:-1]
 
     def to_bytes(self):
-        res = ""
-        for line in self.merge_lines:
-            res += line.to_bytes()
-        return res
+        return "".join(line.to_bytes() for line in self.merge_lines)
 
 
 class CommitMerge:
@@ -422,6 +586,7 @@ class CommitMerge:
         self.files: Dict[bytes, MergeFileDiff] = {}
         self.load()
 
+    @traced("CommitMerge.load")
     def load(self):
         files = list(set(self.left_git_diff.file_diffs).union(set(self.right_git_diff.file_diffs)))
         files.sort()
@@ -452,25 +617,40 @@ class CommitMerge:
         for mergeFileDiff in self.files.values():
             mergeFileDiff.move_right()
 
-    def dump(self):
-        left_res = b""
-        right_res = b""
-        for file in self.files.items():
-            left_dump, right_dump = file[1].dump()
-
-            if len(left_dump) > 0:
-                if len(left_res) > 0 and not left_res.endswith(b"\n"):
-                    left_res += b"\n"
-                left_res += b"diff --git\n"
-                left_res += b"--- a/" + file[0] + b"\n"
-                left_res += b"+++ b/" + file[0] + b"\n"
-                left_res += left_dump
-
-            if len(right_dump) > 0:
-                if len(right_res) > 0 and not right_res.endswith(b"\n"):
-                    right_res += b"\n"
-                right_res += b"diff --git\n"
-                right_res += b"--- a/" + file[0] + b"\n"
-                right_res += b"+++ b/" + file[0] + b"\n"
-                right_res += right_dump
+    def file_diffs(self):
+        """
+        Returns the FileDiffs of the left and right commits, ready to be wrapped in GitDiffs.
+        """
+        left_res = []
+        right_res = []
+        for file_name, merge_file_diff in self.files.items():
+            left, right = merge_file_diff.file_diffs(file_name)
+            if left is not None:
+                left_res.append(left)
+            if right is not None:
+                right_res.append(right)
         return left_res, right_res
+
+    @traced("CommitMerge.dump")
+    def dump(self):
+        left_sink = BytesIO()
+        right_sink = BytesIO()
+        self.write(left_sink, right_sink)
+        return left_sink.getvalue(), right_sink.getvalue()
+
+    def write(self, left_sink, right_sink):
+        """
+        Writes the patches of the left and right commits to binary sinks (see GitDiff.write), a file at a time.
+        """
+        sinks = (left_sink, right_sink)
+        written = [False, False]  # Whether something was written to each sink
+        ends_with_new_line = [False, False]
+        for file_name, merge_file_diff in self.files.items():
+            for side, file_dump in enumerate(merge_file_diff.dump()):
+                if len(file_dump) == 0:
+                    continue
+                separator = b"\n" if written[side] and not ends_with_new_line[side] else b""
+                sinks[side].write(b"".join((separator, b"diff --git\n--- a/", file_name, b"\n+++ b/", file_name, b"\n",
+                                            file_dump)))
+                written[side] = True
+                ends_with_new_line[side] = file_dump.endswith(b"\n")
@@ -0,0 +1,142 @@
+from typing import List, Optional, Dict
+
+from Core.Diff import FileDiff, GitDiff, LineType, to_string
+from Core.GitCommands import Git
+from Core.Tracing import span, traced
+
+
+class PatchError(Exception):
+    pass
+
+
+class FileContent:
+    """
+    Content of a text file as its lines, without their b"\\n", and whether the last one ends with b"\\n".
+    """
+    __slots__ = ("lines", "end_of_line")
+
+    def __init__(self, lines: List[bytes], end_of_line=True):
+        self.lines = lines
+        self.end_of_line = end_of_line
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if data == b"":
+            return cls([])
+        lines = data.split(b"\n")
+        if lines[-1] == b"":
+            lines.pop()
+            return cls(lines)
+        return cls(lines, end_of_line=False)
+
+    def to_bytes(self):
+        if len(self.lines) == 0:
+            return b""
+        return b"\n".join(self.lines) + (b"\n" if self.end_of_line else b"")
+
+
+def apply_file_diff(content: Optional[FileContent], file_diff: FileDiff) -> Optional[FileContent]:
+    """
+    Applies the hunks of file_diff to content (None if the file does not exist), and returns the new content (None if
+    the file is deleted). Hunks must match exactly at the lines given by their stats: unlike "git apply", no offset is
+    searched, so that a successful application proves the line numbers of the patch right.
+    Raises a PatchError if they do not.
+    """
+    if file_diff.creates_file():
+        if content is not None:
+            raise PatchError("the file already exists")
+        content = FileContent([])
+    elif content is None:
+        raise PatchError("the file does not exist")
+
+    old = content.lines
+    new = []
+    position = 0
+    end_of_line = content.end_of_line
+    for hunk in file_diff.hunks:
+        stats = hunk.stats
+        size = 1 if stats.deletionSize == -1 else stats.deletionSize
+        start = stats.deletion_start_line - 1 if size > 0 else stats.deletion_start_line
+        if start < position or start > len(old):
+            raise PatchError("hunk {} is out of the file".format(to_string(stats.to_bytes()).strip()))
+        new += old[position:start]
+        position = start
+
+        last_new_line = None
+        for line in hunk.lines:
+            if line.type == LineType.NO_ENDLINE_CONTEXT:
+                continue
+            if line.type != LineType.ADDITION:
+                if position >= len(old) or old[position] != line.content:
+                    raise PatchError("hunk {} does not match line {}".format(
+                        to_string(stats.to_bytes()).strip(), position + 1))
+                if line.no_new_line and (position + 1 != len(old) or content.end_of_line):
+                    raise PatchError("hunk {} expects no newline at line {}".format(
+                        to_string(stats.to_bytes()).strip(), position + 1))
+                position += 1
+            if line.type != LineType.DELETION:
+                new.append(line.content)
+                last_new_line = line
+
+        if position == len(old):  # The hunk ends the file
+            end_of_line = True if last_new_line is None else not last_new_line.no_new_line
+
+    new += old[position:]
+    if file_diff.deletes_file():
+        if len(new) > 0:
+            raise PatchError("the deleted file is not empty")
+        return None
+    return FileContent(new, end_of_line)
+
+
+class HistoryVerifier:
+    """
+    Checks in memory that a list of GitDiffs (oldest first) applies cleanly on top of base, and that it leads to the
+    content of HEAD. The contents of the files are fetched only once, at base and at HEAD.
+    Only the files which differ between base and HEAD, or which are touched by a patch, need to be compared: all
+    other files are the same in both trees.
+    """
+
+    def __init__(self):
+        self.errors: List[str] = []
+
+    def error(self, message):
+        self.errors.append(message)
+        print(message)
+
+    @staticmethod
+    def content(revision, path: bytes) -> Optional[FileContent]:
+        res = Git.cat_file("{}:{}".format(revision, to_string(path)))
+        if res is None or res[1] != "blob":
+            return None
+        return FileContent.from_bytes(res[2])
+
+    @traced("HistoryVerifier.verify")
+    def verify(self, base, git_diffs: List[GitDiff], head="HEAD") -> bool:
+        self.errors = []
+        contents: Dict[bytes, Optional[FileContent]] = {}
+
+        for git_diff in git_diffs:
+            with span("verify commit", commit=git_diff.hash, files=len(git_diff.file_diffs)):
+                for path, file_diff in git_diff.file_diffs.items():
+                    if path not in contents:
+                        contents[path] = self.content(base, path)
+                    try:
+                        contents[path] = apply_file_diff(contents[path], file_diff)
+                    except PatchError as e:
+                        self.error("Commit '{}', file '{}': {}".format(git_diff.message, to_string(path), e))
+                        return False
+
+        for path in Git.changed_files(base, head):
+            if path not in contents:
+                contents[path] = self.content(base, path)
+
+        for path, content in contents.items():
+            expected = self.content(head, path)
+            if content is None or expected is None:
+                if content is not expected:
+                    self.error("File '{}' {} at the end of the new history".format(
+                        to_string(path), "is missing" if content is None else "should not exist"))
+            elif content.to_bytes() != expected.to_bytes():
+                self.error("File '{}' differs at the end of the new history".format(to_string(path)))
+        return len(self.errors) == 0
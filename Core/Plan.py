@@ -0,0 +1,148 @@
+from typing import List, Iterable
+
+from Core.Commutation import commute
+from Core.Diff import GitDiff, to_string
+from Core.MergeDiff import CommitMerge
+
+OPERATIONS = {"pick": "pick", "p": "pick",
+              "squash": "squash", "s": "squash",
+              "reword": "reword", "r": "reword",
+              "split": "split"}
+
+
+class PlanError(Exception):
+    pass
+
+
+class PlanConflict(PlanError):
+    """
+    Raised when a commit has to be swapped with a commit it conflicts with to reach its place in the plan.
+    """
+
+    def __init__(self, commit: GitDiff, other: GitDiff):
+        super().__init__("'{}' conflicts with '{}'".format(commit.message, other.message))
+        self.commit = commit
+        self.other = other
+        self.files = sorted(to_string(f) for f in set(commit.file_diffs).intersection(other.file_diffs))
+
+
+class Step:
+    __slots__ = ("operation", "commit", "argument", "line_number")
+
+    def __init__(self, operation, commit, argument, line_number):
+        self.operation = operation
+        self.commit = commit
+        self.argument = argument
+        self.line_number = line_number
+
+
+def todo(history: List[GitDiff]) -> str:
+    """
+    Plan keeping the history (newest first, as in Main.history) as it is, in the same order as "git rebase -i".
+    """
+    lines = ["pick {} {}".format(git_diff.hash, git_diff.message) for git_diff in reversed(history)]
+    lines += ["",
+              "# pick <commit> = use commit",
+              "# reword <commit> <subject> = use commit, with a new subject",
+              "# squash <commit> = meld commit into the previous one, keeping its subject",
+              "# split <commit> <file> ... = make a first commit with these files, and a second one with the others",
+              "# Lines can be reordered. Every commit must appear once."]
+    return "\n".join(lines) + "\n"
+
+
+class Plan:
+    """
+    Rebase-todo-like list of operations, oldest commit first.
+    Commits are moved to their new place by swapping adjacent commits, as when they are dragged in the GUI: apply()
+    raises a PlanConflict at the first swap which conflicts.
+    """
+
+    def __init__(self, steps: List[Step]):
+        self.steps = steps
+
+    @classmethod
+    def parse(cls, lines: Iterable[str], history: List[GitDiff]):
+        """
+        Commits may be abbreviated as long as they are unambiguous among the commits of history.
+        """
+        hashes = [git_diff.hash for git_diff in history]
+        steps = []
+        used = set()
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            words = line.split(None, 2)
+            operation = OPERATIONS.get(words[0])
+            if operation is None:
+                raise PlanError("line {}: unknown operation '{}'".format(line_number, words[0]))
+            if len(words) < 2:
+                raise PlanError("line {}: missing commit".format(line_number))
+
+            matches = [h for h in hashes if h.startswith(words[1])]
+            if len(matches) != 1:
+                raise PlanError("line {}: {} commit '{}'".format(
+                    line_number, "unknown" if len(matches) == 0 else "ambiguous", words[1]))
+            if matches[0] in used:
+                raise PlanError("line {}: commit '{}' is used twice".format(line_number, words[1]))
+            used.add(matches[0])
+
+            argument = words[2] if len(words) > 2 else ""
+            if operation in ("reword", "split") and argument == "":
+                raise PlanError("line {}: {} needs {}".format(
+                    line_number, operation, "a subject" if operation == "reword" else "files"))
+            if operation == "squash" and len(steps) == 0:
+                raise PlanError("line {}: cannot squash without a previous commit".format(line_number))
+            steps.append(Step(operation, matches[0], argument, line_number))
+
+        missing = [h for h in hashes if h not in used]
+        if len(missing) > 0:
+            raise PlanError("commits missing from the plan: {}".format(", ".join(missing)))
+        return cls(steps)
+
+    def reorder(self, history: List[GitDiff]) -> List[GitDiff]:
+        """
+        Returns the commits of history in the order of the plan, oldest first.
+        """
+        commits = list(reversed(history))
+        for position, step in enumerate(self.steps):
+            j = position
+            while commits[j].hash != step.commit:
+                j += 1
+            while j > position:
+                previous_diff, current_diff = commits[j - 1], commits[j]
+                commutation = commute(previous_diff, current_diff)
+                if commutation.conflicts:
+                    raise PlanConflict(current_diff, previous_diff)
+                commits[j - 1] = GitDiff(commutation.left_file_diffs, current_diff.hash, current_diff.message)
+                commits[j] = GitDiff(commutation.right_file_diffs, previous_diff.hash, previous_diff.message)
+                j -= 1
+        return commits
+
+    def apply(self, history: List[GitDiff]) -> List[GitDiff]:
+        """
+        Returns the new history, oldest commit first. history is not modified.
+        """
+        res = []
+        for step, git_diff in zip(self.steps, self.reorder(history)):
+            if step.operation == "squash":
+                previous_diff = res[-1]
+                merge = CommitMerge(previous_diff, git_diff)
+                merge.move_left()
+                res[-1] = GitDiff(merge.file_diffs()[0], previous_diff.hash, previous_diff.message)
+            elif step.operation == "reword":
+                res.append(GitDiff(git_diff.file_diffs.values(), git_diff.hash, step.argument))
+            elif step.operation == "split":
+                files = [f.encode("utf8") for f in step.argument.split()]
+                unknown = [to_string(f) for f in files if f not in git_diff.file_diffs]
+                if len(unknown) > 0:
+                    raise PlanError("line {}: '{}' does not modify {}".format(
+                        step.line_number, git_diff.message, ", ".join(unknown)))
+                first = [git_diff.file_diffs[f] for f in files]
+                second = [d for f, d in git_diff.file_diffs.items() if f not in files]
+                res.append(GitDiff(first, git_diff.hash, git_diff.message))
+                if len(second) > 0:
+                    res.append(GitDiff(second, git_diff.hash, git_diff.message))
+            else:
+                res.append(git_diff)
+        return res
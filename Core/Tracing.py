@@ -0,0 +1,140 @@
+"""
+Opt-in tracing of nested spans, exported as Chrome trace events (open the file in chrome://tracing or
+https://ui.perfetto.dev).
+
+Tracing is enabled by setting GITSWAP_TRACE to the path of the file to write when the process exits, or by calling
+start(). When it is disabled, span() returns a shared no-op context manager: the cost is a global lookup and a call.
+
+    with span("parse", commit=git_hash):
+        ...
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+TRACE_VARIABLE = "GITSWAP_TRACE"
+
+
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+
+    def add(self, name, start, end, args):
+        # list.append is atomic: spans can be recorded from several threads
+        self.events.append({"name": name, "ph": "X", "pid": self.pid, "tid": threading.get_ident(),
+                            "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6,
+                            "args": {key: str(value) for key, value in args.items()}})
+
+    def write(self):
+        threads = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident,
+                    "args": {"name": thread.name}} for thread in threading.enumerate()]
+        with open(self.path, "w") as output:
+            json.dump({"traceEvents": threads + self.events, "displayTimeUnit": "ms"}, output)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: Tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.tracer.add(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+    def set(self, **args):
+        """
+        Adds arguments known only once the span is running (sizes of results, ...).
+        """
+        self.args.update(args)
+
+    # For spans which do not match a block of code, such as the lifetime of a process
+    begin = __enter__
+
+    def end(self):
+        self.__exit__()
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def begin(self):
+        return self
+
+    def end(self):
+        pass
+
+
+NULL_SPAN = NullSpan()
+tracer = None
+
+
+def enabled():
+    return tracer is not None
+
+
+def span(name, **args):
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, args)
+
+
+def traced(name):
+    """
+    Decorator wrapping every call of a function in a span.
+    """
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return function(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return function(*args, **kwargs)
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    return decorator
+
+
+def start(path):
+    global tracer
+    stop()
+    tracer = Tracer(path)
+
+
+def stop():
+    """
+    Writes the trace, and disables tracing.
+    """
+    global tracer
+    if tracer is not None:
+        tracer.write()
+        tracer = None
+
+
+atexit.register(stop)
+if os.environ.get(TRACE_VARIABLE):
+    start(os.environ[TRACE_VARIABLE])
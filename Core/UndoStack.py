@@ -0,0 +1,64 @@
+from typing import List, Optional, Tuple
+
+from Core.Diff import GitDiff
+
+
+class Snapshot:
+    """
+    State of a history (newest first, as in Main.history) at a given time, and the row of its oldest modified commit.
+    The GitDiffs are shared with the history and with the other snapshots: they are replaced when a commit changes,
+    never modified, so a snapshot only costs one reference per commit.
+    """
+    __slots__ = ("git_diffs", "modif_index")
+
+    def __init__(self, history: List[GitDiff], modif_index: Optional[int]):
+        self.git_diffs: Tuple[GitDiff, ...] = tuple(history)
+        self.modif_index = modif_index
+
+    def history(self) -> List[GitDiff]:
+        """
+        Returns a new list which can be edited without changing the snapshot, e.g. to try a move and throw it away.
+        """
+        return list(self.git_diffs)
+
+
+class UndoStack:
+    """
+    Snapshots taken before each edit of the history, and the ones left by undo until the next edit.
+    Only the last limit snapshots are kept.
+    """
+
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.undo_snapshots: List[Snapshot] = []
+        self.redo_snapshots: List[Snapshot] = []
+
+    def push(self, snapshot: Snapshot):
+        self.undo_snapshots.append(snapshot)
+        del self.undo_snapshots[:-self.limit]
+        self.redo_snapshots = []
+
+    def can_undo(self):
+        return len(self.undo_snapshots) > 0
+
+    def can_redo(self):
+        return len(self.redo_snapshots) > 0
+
+    def undo(self, current: Snapshot) -> Optional[Snapshot]:
+        """
+        Returns the snapshot to restore, None if there is none, and keeps current for redo.
+        """
+        if not self.can_undo():
+            return None
+        self.redo_snapshots.append(current)
+        return self.undo_snapshots.pop()
+
+    def redo(self, current: Snapshot) -> Optional[Snapshot]:
+        if not self.can_redo():
+            return None
+        self.undo_snapshots.append(current)
+        return self.redo_snapshots.pop()
+
+    def clear(self):
+        self.undo_snapshots = []
+        self.redo_snapshots = []
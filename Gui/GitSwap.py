@@ -7,17 +7,29 @@ import sys
 from collections import OrderedDict
 from typing import List
 
-from PyQt5.QtCore import QItemSelectionModel, QModelIndex
-from PyQt5.QtGui import QStandardItemModel, QStandardItem, QColor
+from PyQt5.QtCore import QItemSelectionModel, QModelIndex, QTimer
+from PyQt5.QtGui import QStandardItemModel, QStandardItem, QKeySequence
 from PyQt5.QtWidgets import QMainWindow, QApplication, QFileDialog, QAbstractItemView, QStyledItemDelegate, \
-    QInputDialog, QErrorMessage, QMessageBox
+    QInputDialog, QErrorMessage, QMessageBox, QShortcut
 
+from Core.CommitWriter import CommitWriter
+from Core.Commutation import commute, ConflictBounds
 from Core.GitCommands import Git
+from Core.DiffCache import DiffCache
+from Core.HistoryLoader import HistoryLoader, DIFF_OPTIONS
 from Core.MergeDiff import CommitMerge
+from Core.PatchApplier import HistoryVerifier
+from Core.Tracing import traced
+from Core.UndoStack import Snapshot, UndoStack
 from Gui.MergeWindow import Merger
-from Gui.helpers import ItemDelegate, append
+from Gui.conflict_worker import ConflictWorker
+from Gui.commit_list_model import CommitListModel
+from Gui.file_diff_model import FileDiffModel
+from Gui.helpers import ItemDelegate
 from Gui.main_window import Ui_MainWindow
-from Core.DiffParser import parse_git_diff, GitDiff
+from Core.Diff import GitDiff
+
+CONFLICT_DELAY = 150  # ms without selection change before computing conflicts
 
 
 class FileDelegate(QStyledItemDelegate):
@@ -47,58 +59,58 @@ class Main(QMainWindow):
         self.merge_window = None
         self.current_modif_index = None
         self.root_commit = None
+        self.conflict_bounds = ConflictBounds(self.history)
+        self.conflict_worker = ConflictWorker(self)
+        self.conflict_worker.computed.connect(self.on_conflicts_computed)
+        self.conflict_timer = QTimer(self)
+        self.conflict_timer.setSingleShot(True)
+        self.conflict_timer.timeout.connect(self.on_conflict_timer)
+        self.diff_model = FileDiffModel(self.mainwidget.diffView)
+        self.undo_stack = UndoStack()
 
         signal.signal(signal.SIGINT, self.sigint_handler)
         self.load_cwd()
         self.configure_widgets()
 
+    @traced("Main.on_commit_dropped")
     def on_commit_dropped(self, row):
+        self.conflict_worker.cancel()
+        self.save_state()
+        first_changed_row, last_changed_row = sorted((self.current_git_diff_index, row))
         current_diff = self.current_git_diff
         conflict = False
 
-        if row > self.current_git_diff_index:
-            for i in range(self.current_git_diff_index, row):
-                previous_diff: GitDiff = self.history[i + 1]
-                previous_files = set(previous_diff.file_diffs.keys())
-                current_files = set(current_diff.file_diffs.keys())
-
-                if len(previous_files.intersection(current_files)) == 0:
-                    continue
+        file_index = self.conflict_bounds.file_index
 
-                merge_diff = CommitMerge(previous_diff, current_diff)
+        if row > self.current_git_diff_index:
+            i = file_index.next_row(self.current_git_diff_index, current_diff.file_diffs, 1)
+            while i is not None and i <= row:
+                previous_diff: GitDiff = self.history[i]
+                commutation = commute(previous_diff, current_diff)
 
-                if merge_diff.conflicts:
+                if commutation.conflicts:
                     conflict = True
                     break
                 else:
-                    merge_diff.swap_all()
-                    new_left, new_right = merge_diff.dump()
-                    current_diff = parse_git_diff(new_left.split(b"\n"), current_diff.hash, current_diff.message)
-                    swapped_diff = parse_git_diff(new_right.split(b"\n"), previous_diff.hash, previous_diff.message)
-                    self.history.pop(i + 1)
-                    self.history.insert(i + 1, swapped_diff)
+                    current_diff = GitDiff(commutation.left_file_diffs, current_diff.hash, current_diff.message)
+                    swapped_diff = GitDiff(commutation.right_file_diffs, previous_diff.hash, previous_diff.message)
+                    self.history[i] = swapped_diff
+                i = file_index.next_row(i, current_diff.file_diffs, 1)
 
         if row < self.current_git_diff_index:
-            for i in range(self.current_git_diff_index, row, -1):
-                next_diff: GitDiff = self.history[i - 1]
-                next_files = set(next_diff.file_diffs.keys())
-                current_files = set(current_diff.file_diffs.keys())
-
-                if len(next_files.intersection(current_files)) == 0:
-                    continue
-
-                merge_diff = CommitMerge(current_diff, next_diff)
+            i = file_index.next_row(self.current_git_diff_index, current_diff.file_diffs, -1)
+            while i is not None and i >= row:
+                next_diff: GitDiff = self.history[i]
+                commutation = commute(current_diff, next_diff)
 
-                if merge_diff.conflicts:
+                if commutation.conflicts:
                     conflict = True
                     break
                 else:
-                    merge_diff.swap_all()
-                    new_left, new_right = merge_diff.dump()
-                    current_diff = parse_git_diff(new_right.split("\n"), current_diff.hash, current_diff.message)
-                    swapped_diff = parse_git_diff(new_left.split("\n"), next_diff.hash, next_diff.message)
-                    self.history.pop(i - 1)
-                    self.history.insert(i - 1, swapped_diff)
+                    current_diff = GitDiff(commutation.right_file_diffs, current_diff.hash, current_diff.message)
+                    swapped_diff = GitDiff(commutation.left_file_diffs, next_diff.hash, next_diff.message)
+                    self.history[i] = swapped_diff
+                i = file_index.next_row(i, current_diff.file_diffs, -1)
 
         if conflict:
             if row < self.current_git_diff_index:
@@ -120,19 +132,62 @@ class Main(QMainWindow):
         self.history.insert(row, current_diff)
         self.current_git_diff_index = row
         self.current_git_diff = current_diff
+        self.conflict_bounds.replace(first_changed_row, last_changed_row + 1, last_changed_row - first_changed_row + 1)
 
         self.refresh(row)
 
     def configure_widgets(self):
         commit_list = self.mainwidget.commitList
         commit_list.setDragDropMode(QAbstractItemView.InternalMove)
+        commit_list.setUniformItemSizes(True)
+
+        self.mainwidget.diffView.setModel(self.diff_model)
+        self.mainwidget.diffView.setUniformItemSizes(True)
         commit_list.setSelectionMode(QAbstractItemView.ContiguousSelection)
 
         self.mainwidget.commitList.dropped.connect(self.on_commit_dropped)
         self.mainwidget.splitButton.pressed.connect(self.on_split_button_pressed)
         self.mainwidget.mergeButton.pressed.connect(self.on_merge_button_pressed)
         self.mainwidget.commitButton.pressed.connect(self.on_commit_button_pressed)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+        QShortcut(QKeySequence("Ctrl+Shift+Z"), self, self.redo)
+
+    def snapshot(self):
+        return Snapshot(self.history, self.current_modif_index)
+
+    def save_state(self):
+        """
+        To call before each edit of the history, which must replace the GitDiffs it changes instead of modifying them.
+        """
+        self.undo_stack.push(self.snapshot())
+
+    def undo(self):
+        snapshot = self.undo_stack.undo(self.snapshot())
+        if snapshot is not None:
+            self.restore(snapshot)
+
+    def redo(self):
+        snapshot = self.undo_stack.redo(self.snapshot())
+        if snapshot is not None:
+            self.restore(snapshot)
+
+    @traced("Main.restore")
+    def restore(self, snapshot: Snapshot):
+        self.conflict_worker.cancel()
+        selection_index = self.current_git_diff_index
+        self.history = snapshot.history()
+        self.current_modif_index = snapshot.modif_index
+        self.update_hash_to_commit()
+        self.conflict_bounds = ConflictBounds(self.history)
+        self.conflict_worker.compute(self.conflict_bounds)
 
+        commit_list = self.mainwidget.commitList
+        commit_list.clearSelection()
+        commit_list.model().refresh()
+        if selection_index is not None and selection_index < len(self.history):
+            commit_list.setCurrentIndex(commit_list.model().index(selection_index, 0))
+
+    @traced("Main.on_commit_button_pressed")
     def on_commit_button_pressed(self):
 
         if self.current_modif_index is None:
@@ -155,31 +210,35 @@ class Main(QMainWindow):
         #         msg.show()
         #         return
 
-        Git.stash()
-        Git.reset_to(commit)
-        for i in range(self.current_modif_index, -1, -1):
-            error = False
-            for file_name in self.history[i].file_diffs:
-                diff = self.history[i].file_diffs[file_name].to_bytes()
-                if not Git.apply_and_stage(diff):
-                    print(
-                        "Error with file '{}' while applying '{}'".format(file_name, self.history[i].message))
-                    error = True
-
-            if error:
-                return
-
-            if not Git.commit(self.history[i].message):
-                print("Error while committing {}".format(self.history[i].message))
-                return
-
-        Git.stash_pop()
-        Git.clean_patch()
+        git_diffs = self.history[self.current_modif_index::-1]
+        verifier = HistoryVerifier()
+        if not verifier.verify(commit, git_diffs):
+            self.show_commit_errors(verifier.errors)
+            return
+
+        writer = CommitWriter()
+        hashes = writer.write(commit, git_diffs)
+        if hashes is None:
+            self.show_commit_errors(writer.errors)
+            return
+
+        for git_diff, new_hash in zip(git_diffs, hashes):
+            git_diff.hash = new_hash
         self.current_modif_index = None
+        self.undo_stack.clear()  # The previous states are not the history of HEAD anymore
+
+    def show_commit_errors(self, errors: List[str]):
+        msg = QMessageBox(self)
+        msg.setWindowTitle("GitSwap - Commit")
+        msg.setIcon(QMessageBox.Critical)
+        msg.setText("Commit canceled:\n" + "\n".join(errors))
+        msg.show()
 
     def on_merge_button_pressed(self):
+        self.conflict_worker.cancel()
+        self.save_state()
         selection_model: QItemSelectionModel = self.mainwidget.commitList.selectionModel()
-        indexes = [int(row.data()) for row in selection_model.selectedRows()]
+        indexes = [row.row() for row in selection_model.selectedRows()]
         indexes.sort()
         indexes_count = len(indexes)
         right = indexes.pop(0)
@@ -188,73 +247,60 @@ class Main(QMainWindow):
             left = indexes.pop(0)
             merge = CommitMerge(self.history[left], res)
             merge.move_left()
-            res = parse_git_diff(merge.dump()[0].split(b"\n"), None, merge.right_git_diff.message)
-
-        start = len(self.history) - indexes_count + 1
-        self.mainwidget.commitList.model().removeRows(start, indexes_count - 1)
+            res = GitDiff(merge.file_diffs()[0], None, merge.right_git_diff.message)
 
         for i in range(0, indexes_count - 1):
             self.history.pop(right)
         self.history[right] = res
+        self.conflict_bounds.replace(right, right + indexes_count, 1)
 
         self.refresh(right)
 
     def on_split_button_pressed(self):
         if self.current_git_diff is not None:
-            item = QStandardItem()
-            item.setText(str(len(self.history)))
-            item.setDropEnabled(False)
-            self.mainwidget.commitList.model().appendRow(item)
+            self.conflict_worker.cancel()
+            self.save_state()
             self.history.insert(self.current_git_diff_index, GitDiff([], None, "Splitting ..."))
+            self.mainwidget.commitList.model().refresh()
+            self.conflict_bounds.replace(self.current_git_diff_index, self.current_git_diff_index, 1)
             empty_commit = GitDiff([], None, self.current_git_diff.message)
             self.merge_window = Merger(self, main_commit_on_left=True)
             self.merge_window.load(self.current_git_diff, empty_commit)
             self.current_conflict_row = self.current_git_diff_index
             self.merge_window.show()
 
-    def on_merger_closed(self, commitMerge: CommitMerge = None, main_commit_on_left=None):
+    def on_merger_closed(self, commitMerge: CommitMerge = None, main_commit_on_left=None, left_message=None,
+                         right_message=None):
+        # Ends the edit started by a drop or a split: no new state is saved
         if commitMerge is not None:
-            new_left, new_right = commitMerge.dump()
-            has_left = new_left != b""
-            has_right = new_right != b""
+            self.conflict_worker.cancel()
+            new_left, new_right = commitMerge.file_diffs()
+            has_left = len(new_left) > 0
+            has_right = len(new_right) > 0
             if has_left:
-                new_left_commit = parse_git_diff(new_left.split(b"\n"), None, commitMerge.left_git_diff.message)
+                new_left_commit = GitDiff(new_left, None, left_message)
             if has_right:
-                new_right_commit = parse_git_diff(new_right.split(b"\n"), None, commitMerge.right_git_diff.message)
+                new_right_commit = GitDiff(new_right, None, right_message)
             self.history.pop(self.current_conflict_row)
             self.history.pop(self.current_conflict_row)
 
             if has_left:
                 self.history.insert(self.current_conflict_row, new_left_commit)
-            else:
-                model = self.mainwidget.commitList.model()
-                model.removeRow(model.rowCount() - 1)
             if has_right:
                 self.history.insert(self.current_conflict_row, new_right_commit)
-            else:
-                model: QStandardItemModel = self.mainwidget.commitList.model()
-                model.removeRow(model.rowCount() - 1)
+            self.conflict_bounds.replace(self.current_conflict_row, self.current_conflict_row + 2,
+                                         int(has_left) + int(has_right))
 
             if main_commit_on_left:
                 self.refresh(self.current_conflict_row + 1, self.current_conflict_row)
             else:
                 self.refresh(self.current_conflict_row + 1, self.current_conflict_row + 1)
 
+    @traced("Main.display_file_diff")
     def display_file_diff(self, data):
-        test = self.current_git_diff.file_diffs[data.encode("utf8")]
-        diff_view = self.mainwidget.diffView
-        diff_model = QStandardItemModel(diff_view)
-
-        for hunk in test.hunks:
-            item = QStandardItem()
-            item.setEditable(False)
-            item.setText(str(hunk.stats))
-            diff_model.appendRow(item)
-            for line in hunk.lines:
-                append(diff_model, str(line))
-
-        diff_view.setModel(diff_model)
-        diff_view.show()
+        file_diff = self.current_git_diff.file_diffs[data.encode("utf8")]
+        self.diff_model.set_file_diff(file_diff)
+        self.mainwidget.diffView.show()
 
     def on_file_selection_changed(self, selected, deselected):
         selection_model: QItemSelectionModel = self.mainwidget.fileView.selectionModel()
@@ -264,8 +310,9 @@ class Main(QMainWindow):
             self.display_file_diff(model_index.data())
         else:
             self.mainwidget.fileView.setModel(QStandardItemModel(self.mainwidget.fileView))
-            self.mainwidget.diffView.setModel(QStandardItemModel(self.mainwidget.diffView))
+            self.diff_model.set_file_diff(None)
 
+    @traced("Main.display_git_diff")
     def display_git_diff(self):
         file_view = self.mainwidget.fileView
         file_model = QStandardItemModel(file_view)
@@ -300,7 +347,7 @@ class Main(QMainWindow):
         """
 
         if len(rows) == 1:
-            self.current_git_diff_index = int(rows[0].data())
+            self.current_git_diff_index = rows[0].row()
             self.current_git_diff: GitDiff = self.history[self.current_git_diff_index]
             row: QModelIndex = rows[0]
             self.display_git_diff()
@@ -310,72 +357,48 @@ class Main(QMainWindow):
             self.current_git_diff = None
             self.mainwidget.fileView.setModel(QStandardItemModel(self.mainwidget.fileView))
             self.reset_conflict_indexes()
-        self.mainwidget.diffView.setModel(QStandardItemModel(self.mainwidget.diffView))
+        self.diff_model.set_file_diff(None)
+        self.paint_conflicts()
 
-        model: QStandardItemModel = self.mainwidget.commitList.model()
-
-        for i in range(0, len(self.history)):
-            item: QStandardItem = model.item(i, 0)
-            if (
-                    self.mainwidget.commitList.top_conflict is not None and i <= self.mainwidget.commitList.top_conflict) or (
-                    self.mainwidget.commitList.bottom_conflict is not None and i >= self.mainwidget.commitList.bottom_conflict):
-                if i == self.mainwidget.commitList.top_conflict or i == self.mainwidget.commitList.bottom_conflict:
-                    item.setBackground(QColor(255, 255, 0, 127))
-                else:
-                    item.setBackground(QColor(159, 159, 159, 127))
-            else:
-                item.setBackground(QColor(255, 255, 255))
+    def paint_conflicts(self):
+        # The delegate paints the conflicts from the bounds: only the visible rows are repainted
+        self.mainwidget.commitList.viewport().update()
 
     def compute_conflicts(self, row):
-        current_diff = self.history[row]
-        top_conflict = None
-        bottom_conflict = None
-        for i in range(row - 1, -1, -1):
-            next_diff: GitDiff = self.history[i]
-            next_files = set(next_diff.file_diffs.keys())
-            current_files = set(current_diff.file_diffs.keys())
-
-            if len(next_files.intersection(current_files)) == 0:
-                continue
-
-            merge_diff = CommitMerge(current_diff, next_diff)
-
-            if merge_diff.conflicts:
-                top_conflict = i
-                break
-            else:
-                merge_diff.swap_all()
-                current_diff = parse_git_diff(merge_diff.dump()[1].split(b"\n"), current_diff.hash, current_diff.message)
-
-        for i in range(row + 1, len(self.history)):
-            previous_diff: GitDiff = self.history[i]
-            previous_files = set(previous_diff.file_diffs.keys())
-            current_files = set(current_diff.file_diffs.keys())
-
-            if len(previous_files.intersection(current_files)) == 0:
-                continue
-
-            merge_diff = CommitMerge(previous_diff, current_diff)
+        """
+        Shows the conflicts of row if they are already known. Otherwise they are computed by the conflict worker once
+        the selection stops changing for CONFLICT_DELAY ms, and shown by on_conflicts_computed.
+        """
+        self.conflict_worker.cancel()
+        if self.conflict_bounds.known(row):
+            self.show_conflicts(row)
+        else:
+            self.reset_conflict_indexes()
+        self.conflict_timer.start(CONFLICT_DELAY)
 
-            if merge_diff.conflicts:
-                bottom_conflict = i
-                break
-            else:
-                merge_diff.swap_all()
-                current_diff = parse_git_diff(merge_diff.dump()[0].split(b"\n"), current_diff.hash, current_diff.message)
+    def show_conflicts(self, row):
+        top_conflict, bottom_conflict = self.conflict_bounds.get(row)
         self.mainwidget.commitList.top_conflict = top_conflict
         self.mainwidget.commitList.bottom_conflict = bottom_conflict
         self.mainwidget.commitList.current_index = row
 
+    def on_conflict_timer(self):
+        # Also resumes the computation of the other rows, cancelled by the last selection change
+        self.conflict_worker.compute(self.conflict_bounds, self.current_git_diff_index)
+
+    def on_conflicts_computed(self, generation, row, bounds):
+        # Results of a cancelled run: the history may have been edited since
+        if not self.conflict_worker.is_current(generation):
+            return
+        self.conflict_bounds.set(row, bounds)
+        if row == self.current_git_diff_index:
+            self.show_conflicts(row)
+            self.paint_conflicts()
+
     def on_path_clicked(self):
         Git.path = str(QFileDialog.getExistingDirectory(self, "Select Directory"))
         self.load_cwd()
 
-    def load_commit(self, commit):
-        raw_diff = Git.raw_diff(commit)
-        gitDiff = parse_git_diff(raw_diff, commit, Git.message(commit))
-        self.history.append(gitDiff)
-
     def refresh(self, modif_index, selection_index=None):
         if selection_index is None:
             selection_index = modif_index
@@ -386,6 +409,7 @@ class Main(QMainWindow):
         else:
             self.current_modif_index = max(modif_index, self.current_modif_index)
 
+        self.mainwidget.commitList.model().refresh()
         self.mainwidget.commitList.setCurrentIndex(self.mainwidget.commitList.model().index(selection_index, 0))
 
     def update_hash_to_commit(self):
@@ -393,31 +417,23 @@ class Main(QMainWindow):
         for elt in self.history:
             self.hash_to_diff[elt.hash] = elt
 
+    @traced("Main.load_history")
     def load_history(self):
+        self.conflict_worker.cancel()
         self.history = []
         if Git.valid_repository():
-            current_commit = Git.current_hash()
-            parents = Git.parents(current_commit)
-            while len(parents) <= 1 and \
-                    current_commit != "1b9e9cf66fe61bd4ebee912d8ea48aa55e167bae":
-                self.load_commit(current_commit)
-                if len(parents) == 0:
-                    break
-                current_commit = parents[0]
-                parents = Git.parents(current_commit)
-            self.root_commit = current_commit
+            loader = HistoryLoader(Git.path, stop_commit="1b9e9cf66fe61bd4ebee912d8ea48aa55e167bae",
+                                   cache=DiffCache.for_repository(Git.path, DIFF_OPTIONS))
+            self.history.extend(loader)
+            self.root_commit = loader.root_commit
 
         self.update_hash_to_commit()
+        self.conflict_bounds = ConflictBounds(self.history)
+        self.conflict_worker.compute(self.conflict_bounds)
+        self.undo_stack.clear()
 
         commit_list = self.mainwidget.commitList
-        commit_model = QStandardItemModel(commit_list)
-
-        for i in range(0, len(self.history)):
-            item = QStandardItem()
-            item.setText(str(i))
-            item.setDropEnabled(False)
-            commit_model.appendRow(item)
-
+        commit_model = CommitListModel(self, commit_list)
         commit_list.setItemDelegate(ItemDelegate(self, commit_list))
         commit_list.setModel(commit_model)
         commit_model = commit_list.selectionModel()  # Weird Bug in PyQt ?
@@ -431,7 +447,10 @@ class Main(QMainWindow):
         message, accepted = QInputDialog.getMultiLineText(self, "Renaming commit message", "",
                                                           self.history[self.current_git_diff_index].message)
         if accepted:
-            self.history[self.current_git_diff_index].message = message
+            self.save_state()
+            git_diff = self.history[self.current_git_diff_index]
+            self.current_git_diff = GitDiff(git_diff.file_diffs.values(), git_diff.hash, message)
+            self.history[self.current_git_diff_index] = self.current_git_diff
         self.refresh(self.current_git_diff_index)
 
     def load_cwd(self):
@@ -7,8 +7,9 @@ from PyQt5.QtWidgets import QMainWindow, QListView, QAbstractItemView
 
 from Core.MergeDiff import CommitMerge, MergeFileDiff, MergeLine
 from Core.Diff import GitDiff
+from Core.Tracing import span, traced
 from Gui.merger import Ui_Merger
-from Gui.helpers import append_middle, append
+from Gui.merge_model import MergeModel, LEFT_INDEX, LEFT_LINE, MIDDLE_INDEX, RIGHT_INDEX, RIGHT_LINE
 
 
 def keyPressEvent(event):
@@ -27,6 +28,7 @@ class Merger(QMainWindow):
 
         self.main_widget = Ui_Merger()
         self.main_widget.setupUi(self)
+        self.merge_model = MergeModel(self)
         self.configure()
         self.current_file_name: bytes = None
         self.main_commit_on_left = main_commit_on_left
@@ -39,6 +41,17 @@ class Merger(QMainWindow):
             second_widget.verticalScrollBar().valueChanged.connect(
                 first_widget.verticalScrollBar().setValue)
 
+        # The five lists show the columns of a single model
+        for view, column in ((self.main_widget.leftIndexes, LEFT_INDEX),
+                             (self.main_widget.leftCommitWidget, LEFT_LINE),
+                             (self.main_widget.middleIndexes, MIDDLE_INDEX),
+                             (self.main_widget.rightIndexes, RIGHT_INDEX),
+                             (self.main_widget.rightCommitWidget, RIGHT_LINE)):
+            view.setModel(self.merge_model)
+            view.setModelColumn(column)
+            view.setUniformItemSizes(True)
+        self.setup_sync()
+
         connect_scrollbars(self.main_widget.leftIndexes, self.main_widget.leftCommitWidget)
         connect_scrollbars(self.main_widget.leftCommitWidget, self.main_widget.middleIndexes)
         connect_scrollbars(self.main_widget.middleIndexes, self.main_widget.rightIndexes)
@@ -69,10 +82,9 @@ class Merger(QMainWindow):
 
     def on_key_swap(self):
         left_selection_model: QItemSelectionModel = self.main_widget.leftCommitWidget.selectionModel()
-        selection: List[QModelIndex] = left_selection_model.selectedRows()
-        for line in selection:
-            self.current_merge().move(line.row())
-        self.display_file(self.current_file_name)
+        selection: List[QModelIndex] = left_selection_model.selectedIndexes()
+        rows = self.current_merge().move_lines(sorted(line.row() for line in selection))
+        self.update_lines(rows)
 
     def current_merge(self):
         return self.commit_merge.files[self.current_file_name]
@@ -95,18 +107,17 @@ class Merger(QMainWindow):
 
     def on_move_left_pressed(self):
         if self.current_file_name is not None:
-            self.current_merge().move_left()
-        self.display_file(self.current_file_name)
+            self.update_lines(self.current_merge().move_left())
 
     def on_move_right_pressed(self):
         if self.current_file_name is not None:
-            self.commit_merge.files[self.current_file_name].move_right()
-        self.display_file(self.current_file_name)
+            self.update_lines(self.current_merge().move_right())
 
     def on_apply_pressed(self):
-        self.commit_merge.left_git_diff.message = self.main_widget.leftMessage.toPlainText()
-        self.commit_merge.right_git_diff.message = self.main_widget.rightMessage.toPlainText()
-        self.parent().on_merger_closed(self.commit_merge, self.main_commit_on_left)
+        # The GitDiffs of the history are shared with the undo snapshots: the messages go to the new ones
+        self.parent().on_merger_closed(self.commit_merge, self.main_commit_on_left,
+                                       self.main_widget.leftMessage.toPlainText(),
+                                       self.main_widget.rightMessage.toPlainText())
         self.close()
 
     def closeEvent(self, event: QCloseEvent):
@@ -119,6 +130,7 @@ class Merger(QMainWindow):
         else:
             super().keyPressEvent(e)
 
+    @traced("Merger.load")
     def load(self, left_commit: GitDiff, right_commit: GitDiff):
 
         self.commit_merge = CommitMerge(left_commit, right_commit)
@@ -155,9 +167,7 @@ class Merger(QMainWindow):
             model_index: QModelIndex = rows[0]
             self.display_file(model_index.data().strip("!").encode("utf8"))
         else:
-            # Reset item model
-            main_widget.leftCommitWidget.setModel(QStandardItemModel(main_widget.leftCommitWidget))
-            main_widget.rightCommitWidget.setModel(QStandardItemModel(main_widget.rightCommitWidget))
+            self.merge_model.set_merge_file_diff(None)
             self.current_file_name = None
 
     def setup_sync(self):
@@ -175,59 +185,40 @@ class Merger(QMainWindow):
     def synchronize_selection(self, from_list: QListView, to_list: QListView):
         source_selection_model: QItemSelectionModel = from_list.selectionModel()
         destination_selection_model: QItemSelectionModel = to_list.selectionModel()
-        rows = source_selection_model.selectedRows()
+        rows = source_selection_model.selectedIndexes()
         if len(rows) > 0:
             idx = [r.row() for r in rows]
             min_idx, max_idx = min(idx), max(idx)
-            top_index = QModelIndex(to_list.model().index(min_idx, 0))
-            bottom_index = QModelIndex(to_list.model().index(max_idx, 0))
+            top_index = QModelIndex(to_list.model().index(min_idx, to_list.modelColumn()))
+            bottom_index = QModelIndex(to_list.model().index(max_idx, to_list.modelColumn()))
             destination_selection_model.select(QItemSelection(top_index, bottom_index),
                                                QItemSelectionModel.ClearAndSelect)
 
     def display_file(self, file):
+        with span("Merger.display_file", file=file,
+                  lines=len(self.commit_merge.files[file].merge_lines)):
+            self._display_file(file)
+
+    def _display_file(self, file):
         self.current_file_name = file
         merged_file_diff: MergeFileDiff = self.commit_merge.files[file]
-        self.main_widget: Ui_Merger = self.main_widget
-
-        left_idx_list = self.main_widget.leftIndexes
-        left_idx_model = QStandardItemModel(left_idx_list)
-        left_list = self.main_widget.leftCommitWidget
-        left_model = QStandardItemModel(left_list)
-        middle_list = self.main_widget.middleIndexes
-        middle_idx_model = QStandardItemModel(middle_list)
-        right_idx_list = self.main_widget.rightIndexes
-        right_idx_model = QStandardItemModel(right_idx_list)
-        right_list = self.main_widget.rightCommitWidget
-        right_model = QStandardItemModel(right_list)
-
-        for line in merged_file_diff.merge_lines:
-            append(left_idx_model, line.left_index)
-            append(left_model, line.dump_as_left()[2])
-            middle_text = str(line.middle_index) if line.middle_index is not None else ""
-
-            if line.conflicts:
-                middle_text += "!"
-            append_middle(middle_idx_model, middle_text)
-
-            append(right_idx_model, line.right_index)
-            append(right_model, line.dump_as_right()[2])
-
-        left_idx_list.setModel(left_idx_model)
-        left_list.setModel(left_model)
-        middle_list.setModel(middle_idx_model)
-        right_idx_list.setModel(right_idx_model)
-        right_list.setModel(right_model)
-
-        self.main_widget.leftIndexes.setMinimumWidth(self.main_widget.leftIndexes.sizeHintForColumn(0) + 4)
-        self.main_widget.leftIndexes.setMaximumWidth(self.main_widget.leftIndexes.sizeHintForColumn(0) + 4)
-        self.main_widget.leftIndexes.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-
-        self.main_widget.middleIndexes.setMinimumWidth(self.main_widget.middleIndexes.sizeHintForColumn(0) + 4)
-        self.main_widget.middleIndexes.setMaximumWidth(self.main_widget.middleIndexes.sizeHintForColumn(0) + 4)
-        self.main_widget.middleIndexes.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-
-        self.main_widget.rightIndexes.setMinimumWidth(self.main_widget.rightIndexes.sizeHintForColumn(0) + 4)
-        self.main_widget.rightIndexes.setMaximumWidth(self.main_widget.rightIndexes.sizeHintForColumn(0) + 4)
-        self.main_widget.rightIndexes.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-
-        self.setup_sync()
+        self.merge_model.set_merge_file_diff(merged_file_diff)
+
+        for index_list, column in ((self.main_widget.leftIndexes, LEFT_INDEX),
+                                   (self.main_widget.middleIndexes, MIDDLE_INDEX),
+                                   (self.main_widget.rightIndexes, RIGHT_INDEX)):
+            self.resize_index_list(index_list, column)
+            index_list.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+
+    def resize_index_list(self, index_list: QListView, column):
+        width = self.merge_model.index_width(column)
+        index_list.setMinimumWidth(width)
+        index_list.setMaximumWidth(width)
+
+    def update_lines(self, rows):
+        """
+        Shows the lines moved in the current file: only the middle indexes may need a wider column.
+        """
+        with span("Merger.update_lines", file=self.current_file_name, rows=len(rows)):
+            self.merge_model.rows_moved(rows)
+            self.resize_index_list(self.main_widget.middleIndexes, MIDDLE_INDEX)
@@ -0,0 +1,49 @@
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+
+class CommitListModel(QAbstractListModel):
+    """
+    One row per GitDiff of the history of the main window, read from the history when a row is painted.
+    The history is modified in place by the main window, which calls refresh() afterwards: only the number of rows is
+    kept here.
+    """
+
+    def __init__(self, window, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.row_count = len(window.history)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.row_count
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        # Not drop enabled: commits are dropped between rows, never on a row
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.window.history):
+            return None
+        if role == Qt.DisplayRole:
+            return self.window.history[index.row()].message
+        return None
+
+    def refresh(self):
+        """
+        Follows the number of commits of the history, and repaints the visible rows.
+        """
+        count = len(self.window.history)
+        if count > self.row_count:
+            self.beginInsertRows(QModelIndex(), self.row_count, count - 1)
+            self.row_count = count
+            self.endInsertRows()
+        elif count < self.row_count:
+            self.beginRemoveRows(QModelIndex(), count, self.row_count - 1)
+            self.row_count = count
+            self.endRemoveRows()
+        if count > 0:
+            self.dataChanged.emit(self.index(0), self.index(count - 1), [Qt.DisplayRole])
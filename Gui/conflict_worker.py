@@ -0,0 +1,64 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from Core.Commutation import ConflictBounds
+
+
+class ConflictWorker(QThread):
+    """
+    Computes the conflict bounds of a history in the background: the selected row first, then all the others so that
+    later selections are immediate.
+    Each run works on a snapshot of the bounds (see ConflictBounds.snapshot), so the history can be edited while it
+    runs, and has a generation: cancel() or a newer run makes it stale, it then stops at its next commutation, and the
+    receivers of computed drop its results (see is_current).
+    """
+    computed = pyqtSignal(int, int, object)  # Generation, row, bounds
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.generation = 0
+        self.pending = None  # Run waiting for the stale one to return: (snapshot, first row, generation)
+        self.conflict_bounds: ConflictBounds = None
+        self.first_row = None
+        self.run_generation = 0
+        self.finished.connect(self.start_pending)
+
+    def compute(self, conflict_bounds: ConflictBounds, first_row=None):
+        # Never waits for the current run: it is cancelled, and this one starts once it has returned
+        self.generation += 1
+        self.pending = (conflict_bounds.snapshot(), first_row, self.generation)
+        if not self.isRunning():
+            self.start_pending()
+
+    def start_pending(self):
+        if self.pending is None or self.isRunning():
+            return
+        self.conflict_bounds, self.first_row, self.run_generation = self.pending
+        self.pending = None
+        if self.is_current(self.run_generation):
+            self.start()
+
+    def cancel(self):
+        # Returns immediately, the computation stops at its next commutation
+        self.generation += 1
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def run(self):
+        conflict_bounds = self.conflict_bounds
+        generation = self.run_generation
+
+        def is_cancelled():
+            return not self.is_current(generation)
+
+        rows = range(0, len(conflict_bounds.history))
+        if self.first_row is not None:
+            rows = [self.first_row] + [row for row in rows if row != self.first_row]
+        for row in rows:
+            if is_cancelled():
+                return
+            if not conflict_bounds.known(row):
+                bounds = conflict_bounds.get(row, is_cancelled)
+                if bounds is None:
+                    return
+                self.computed.emit(generation, row, bounds)
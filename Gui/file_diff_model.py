@@ -0,0 +1,74 @@
+from typing import Optional
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from Core.Diff import FileDiff, Stats
+from Gui.helpers import diff_font, line_background
+
+FETCH_SIZE = 500  # rows added each time the view scrolls to the last fetched row
+
+
+class FileDiffModel(QAbstractListModel):
+    """
+    One row per hunk header and per line of a FileDiff. Rows are fetched by the view with canFetchMore/fetchMore as
+    it scrolls, so that showing a large file only walks the lines which are visible.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file_diff: Optional[FileDiff] = None
+        self.rows = []  # Stats of a hunk, or Line
+        self.hunk_index = 0  # Next hunk to fetch
+        self.line_index = -1  # Next line of that hunk to fetch, -1 for its header
+        self.font = diff_font()
+
+    def set_file_diff(self, file_diff: Optional[FileDiff]):
+        self.beginResetModel()
+        self.file_diff = file_diff
+        self.rows = []
+        self.hunk_index = 0
+        self.line_index = -1
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.file_diff is not None and \
+            self.hunk_index < len(self.file_diff.hunks)
+
+    def fetchMore(self, parent=QModelIndex()):
+        hunks = self.file_diff.hunks
+        rows = []
+        while len(rows) < FETCH_SIZE and self.hunk_index < len(hunks):
+            hunk = hunks[self.hunk_index]
+            if self.line_index == -1:
+                rows.append(hunk.stats)
+                self.line_index = 0
+            end = min(len(hunk.lines), self.line_index + FETCH_SIZE - len(rows))
+            rows += hunk.lines[self.line_index:end]
+            self.line_index = end
+            if self.line_index == len(hunk.lines):
+                self.hunk_index += 1
+                self.line_index = -1
+
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows += rows
+        self.endInsertRows()
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if isinstance(row, Stats):
+            return str(row) if role == Qt.DisplayRole else None
+        if role == Qt.DisplayRole:
+            return str(row)
+        if role == Qt.FontRole:
+            return self.font
+        if role == Qt.BackgroundRole:
+            return line_background(str(row))
+        return None
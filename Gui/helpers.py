@@ -1,5 +1,5 @@
 import platform
-from PyQt5.QtGui import QStandardItem, QFont, QColor
+from PyQt5.QtGui import QStandardItem, QFont, QColor, QBrush
 from PyQt5.QtWidgets import QStyledItemDelegate
 
 if platform.system() == 'Windows':
@@ -7,24 +7,61 @@ if platform.system() == 'Windows':
 else:
     FONT_DIFF = 2
 
+ADDITION_BRUSH = QBrush(QColor(0, 255, 0, 127))
+DELETION_BRUSH = QBrush(QColor(255, 0, 0, 127))
+EMPTY_BRUSH = QBrush(QColor(0, 0, 0, 47))
+CONFLICT_BRUSH = QBrush(QColor(255, 255, 0, 127))
+UNREACHABLE_BRUSH = QBrush(QColor(159, 159, 159, 127))
+
+
+def diff_font(font: QFont = None):
+    font = QFont() if font is None else QFont(font)
+    font.setFamily("Courier New")
+    font.setPointSize(font.pointSize() - FONT_DIFF)
+    return font
+
+
+def line_background(text):
+    if text.startswith("+"):
+        return ADDITION_BRUSH
+    if text.startswith("-"):
+        return DELETION_BRUSH
+    if text == "":
+        return EMPTY_BRUSH
+    return None
+
+
+def middle_background(text):
+    if text.endswith("!") or text.endswith("!>"):
+        return CONFLICT_BRUSH
+    if text == "":
+        return EMPTY_BRUSH
+    return None
+
 
 class ItemDelegate(QStyledItemDelegate):
+    """
+    Paints the commits of the main window from the conflict bounds of the selected commit: the first conflicting
+    commits are marked, and the commits beyond them are greyed out.
+    """
+
     def __init__(self, window, parent_list):
         super().__init__(parent_list)
         self.window = window
 
-    def displayText(self, value, locale):
-        if isinstance(value, str):
-            index = int(value)
-            top_index = self.window.mainwidget.commitList.top_conflict
-            bottom_index = self.window.mainwidget.commitList.bottom_conflict
-            if (top_index is None or index > top_index) and (bottom_index is None or index < bottom_index):
-                return self.window.history[index].message
-            elif (top_index is not None and index == top_index) or (bottom_index is not None and index == bottom_index):
-                return "/!\\ " + self.window.history[index].message
-            else:
-                return "? " + self.window.history[index].message
-        return value
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        row = index.row()
+        top_index = self.window.mainwidget.commitList.top_conflict
+        bottom_index = self.window.mainwidget.commitList.bottom_conflict
+        if (top_index is None or row > top_index) and (bottom_index is None or row < bottom_index):
+            return
+        if row == top_index or row == bottom_index:
+            option.text = "/!\\ " + option.text
+            option.backgroundBrush = CONFLICT_BRUSH
+        else:
+            option.text = "? " + option.text
+            option.backgroundBrush = UNREACHABLE_BRUSH
 
 
 def append_middle(model, text):
@@ -33,14 +70,10 @@ def append_middle(model, text):
     item.setText(text)
     item.setDropEnabled(False)
     item.setEditable(False)
-    font: QFont = item.font()
-    font.setFamily("Courier New")
-    font.setPointSize(font.pointSize() - FONT_DIFF)
-    item.setFont(font)
-    if text.endswith("!") or text.endswith("!>"):
-        item.setBackground(QColor(255, 255, 0, 127))
-    if text == "":
-        item.setBackground(QColor(0, 0, 0, 47))
+    item.setFont(diff_font(item.font()))
+    background = middle_background(text)
+    if background is not None:
+        item.setBackground(background)
 
     model.appendRow(item)
 
@@ -51,15 +84,9 @@ def append(model, text):
     item.setText(text)
     item.setDropEnabled(False)
     item.setEditable(False)
-    font: QFont = item.font()
-    font.setFamily("Courier New")
-    font.setPointSize(font.pointSize() - FONT_DIFF)
-    item.setFont(font)
-    if text.startswith("+"):
-        item.setBackground(QColor(0, 255, 0, 127))
-    if text.startswith("-"):
-        item.setBackground(QColor(255, 0, 0, 127))
-    if text == "":
-        item.setBackground(QColor(0, 0, 0, 47))
+    item.setFont(diff_font(item.font()))
+    background = line_background(text)
+    if background is not None:
+        item.setBackground(background)
 
     model.appendRow(item)
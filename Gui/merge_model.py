@@ -0,0 +1,99 @@
+from typing import Optional, List
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QFontMetrics
+
+from Core.MergeDiff import MergeFileDiff
+from Gui.helpers import diff_font, line_background, middle_background
+
+LEFT_INDEX, LEFT_LINE, MIDDLE_INDEX, RIGHT_INDEX, RIGHT_LINE = range(5)
+
+
+class MergeModel(QAbstractTableModel):
+    """
+    One row per MergeLine of a MergeFileDiff, one column per list view of the Merger (see setModelColumn).
+    Texts are computed when a row is painted, from the MergeLines themselves: the cost of showing a file does not
+    depend on its size.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.merge_file_diff: Optional[MergeFileDiff] = None
+        self.font = diff_font()
+
+    def set_merge_file_diff(self, merge_file_diff: Optional[MergeFileDiff]):
+        self.beginResetModel()
+        self.merge_file_diff = merge_file_diff
+        self.endResetModel()
+
+    def rows_moved(self, rows: List[int]):
+        """
+        Repaints the rows returned by a move operation of the MergeFileDiff: every column of these rows, and the middle
+        indexes of the rows after the first one. Only the visible part of these ranges is painted again.
+        """
+        if len(rows) == 0:
+            return
+        first = last = rows[0]
+        for row in rows[1:] + [None]:
+            if row is not None and row == last + 1:
+                last = row
+                continue
+            self.dataChanged.emit(self.index(first, LEFT_INDEX), self.index(last, RIGHT_LINE))
+            first = last = row
+        self.dataChanged.emit(self.index(rows[0], MIDDLE_INDEX), self.index(self.rowCount() - 1, MIDDLE_INDEX))
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.merge_file_diff is None:
+            return 0
+        return len(self.merge_file_diff.merge_lines)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 5
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def text(self, row, column):
+        line = self.merge_file_diff.merge_lines[row]
+        if column == LEFT_INDEX:
+            value = line.left_index
+        elif column == LEFT_LINE:
+            value = line.dump_as_left()[2]
+        elif column == MIDDLE_INDEX:
+            middle_index = line.middle_index
+            value = ("" if middle_index is None else str(middle_index)) + ("!" if line.conflicts else "")
+        elif column == RIGHT_INDEX:
+            value = line.right_index
+        else:
+            value = line.dump_as_right()[2]
+        return "" if value is None else str(value)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.text(index.row(), index.column())
+        if role == Qt.FontRole:
+            return self.font
+        if role == Qt.BackgroundRole:
+            text = self.text(index.row(), index.column())
+            if index.column() == MIDDLE_INDEX:
+                return middle_background(text)
+            return line_background(text)
+        return None
+
+    def index_width(self, column):
+        """
+        Width of the widest index of column, from the font metrics instead of the size of every row.
+        """
+        largest = 0
+        if self.merge_file_diff is not None:
+            lines = self.merge_file_diff.merge_lines
+            attribute = {LEFT_INDEX: "left_index", MIDDLE_INDEX: "middle_index", RIGHT_INDEX: "right_index"}[column]
+            for line in reversed(lines):  # Indexes grow along the lines: the last one is the largest
+                value = getattr(line, attribute)
+                if value is not None:
+                    largest = value
+                    break
+        text = "9" * len(str(largest)) + ("!" if column == MIDDLE_INDEX else "")
+        return QFontMetrics(self.font).boundingRect(text).width() + 12